@@ -0,0 +1,199 @@
+import json
+import time
+from dataclasses import dataclass
+
+import aiohttp
+
+from es_client import ElasticClient
+
+from logger import logger
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+@dataclass
+class BulkItemFailure:
+    action: str
+    index: str
+    id: str
+    status: int
+    reason: str
+
+
+class _Item(NamedTuple):
+    raw: bytes
+    # (индекс, id документа): порядок операций важен только внутри одного ключа
+    key: Tuple[str, str]
+    # Метка вызывающего кода (например, смещение Kafka), см. pop_done
+    tag: Any
+
+
+class BulkIndexer:
+    """
+    Копит операции для Elasticsearch и отправляет их одним NDJSON запросом в _bulk.
+
+    Буфер сбрасывается, когда набирается max_actions операций, max_bytes байт
+    или с момента первой операции прошло flush_interval секунд. refresh
+    передается в _bulk как есть: с "wait_for" ответ приходит, когда изменения
+    уже видны в поиске.
+
+    Операции одного документа применяются в порядке добавления: если операция
+    отклонена с 429, вместе с ней на повтор возвращаются и все более поздние
+    операции того же документа из пачки, даже успешные.
+    """
+
+    def __init__(
+        self,
+        client: ElasticClient,
+        max_actions: int = 500,
+        max_bytes: int = 5 * 1024 * 1024,
+        flush_interval: float = 1.0,
+        refresh: Optional[str] = None,
+    ):
+        self.client = client
+        self.max_actions = max_actions
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.refresh = refresh
+
+        self._items: List[_Item] = []
+        self._size = 0
+        self._first_added_at: Optional[float] = None
+        self._done: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, lines: List[Dict[str, Any]], tag: Any = None) -> None:
+        """
+        Добавляет одну операцию: строку действия и, если нужно, тело документа.
+        Если задан tag, он вернется из pop_done, когда операция будет
+        окончательно обработана.
+        """
+        raw = b"".join(
+            json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n"
+            for line in lines
+        )
+        meta = next(iter(lines[0].values()))
+        key = (str(meta.get("_index", "")), str(meta.get("_id", "")))
+        self._append(_Item(raw, key, tag))
+
+    def _append(self, item: _Item) -> None:
+        if not self._items:
+            self._first_added_at = time.monotonic()
+        self._items.append(item)
+        self._size += len(item.raw)
+
+    def pop_done(self) -> List[Any]:
+        """
+        Метки операций, обработанных с прошлого вызова: успешно или с ошибкой,
+        которую повтор не исправит. Операции, ожидающие повтора, сюда не попадают.
+        """
+        done = self._done
+        self._done = []
+        return done
+
+    def discard(self, predicate: Callable[[Any], bool]) -> int:
+        """
+        Убирает из буфера еще не отправленные операции, для меток которых
+        predicate истинен, и возвращает их количество. Метки таких операций
+        убираются и из pop_done.
+        """
+        kept = [
+            item for item in self._items if item.tag is None or not predicate(item.tag)
+        ]
+        removed = len(self._items) - len(kept)
+        if removed:
+            self._items = kept
+            self._size = sum(len(item.raw) for item in kept)
+            if not kept:
+                self._first_added_at = None
+        self._done = [tag for tag in self._done if not predicate(tag)]
+        return removed
+
+    def is_full(self) -> bool:
+        return len(self._items) >= self.max_actions or self._size >= self.max_bytes
+
+    def is_due(self) -> bool:
+        if self._first_added_at is None:
+            return False
+        return time.monotonic() - self._first_added_at >= self.flush_interval
+
+    def should_flush(self) -> bool:
+        return self.is_full() or self.is_due()
+
+    async def flush(self) -> List[BulkItemFailure]:
+        """
+        Отправляет накопленные операции в Elasticsearch.
+
+        Во время запроса в буфер можно добавлять новые операции. При ошибке
+        запроса отправленные операции возвращаются в начало буфера и поднимается
+        aiohttp.ClientError. Операции, отклоненные с 429, и следующие за ними
+        операции тех же документов тоже возвращаются в начало буфера.
+        """
+        if not self._items:
+            return []
+
+        items = self._items
+        first_added_at = self._first_added_at
+        self._items = []
+        self._size = 0
+        self._first_added_at = None
+
+        try:
+            async with self.client.session.post(
+                "/_bulk",
+                params={"refresh": self.refresh} if self.refresh else None,
+                data=b"".join(item.raw for item in items),
+                headers={"Content-Type": "application/x-ndjson"},
+            ) as response:
+                if response.status != 200:
+                    raise aiohttp.ClientError(
+                        f"bulk request failed with status {response.status}"
+                    )
+                result = await response.json()
+        except BaseException:
+            self._prepend(items, first_added_at)
+            raise
+
+        logger.info(f"{len(items)} operations sent to elastic in one bulk request")
+
+        if not result.get("errors"):
+            self._done.extend(item.tag for item in items if item.tag is not None)
+            return []
+
+        failures = []
+        retry = []
+        retry_keys = set()
+        for entry, item in zip(result["items"], items):
+            action, info = next(iter(entry.items()))
+            status = info.get("status", 500)
+            if item.key in retry_keys:
+                # Более ранняя операция документа ушла на повтор: эту тоже
+                # повторяем после нее, иначе порядок операций нарушится
+                retry.append(item)
+                continue
+            if status == 429:
+                retry.append(item)
+                retry_keys.add(item.key)
+            elif item.tag is not None:
+                self._done.append(item.tag)
+            if status < 300 or (action == "delete" and status == 404):
+                continue
+            failures.append(
+                BulkItemFailure(
+                    action=action,
+                    index=info.get("_index", ""),
+                    id=info.get("_id", ""),
+                    status=status,
+                    reason=str(info.get("error", "")),
+                )
+            )
+        if retry:
+            self._prepend(retry, first_added_at)
+        return failures
+
+    def _prepend(self, items: List[_Item], first_added_at: Optional[float]) -> None:
+        self._items = items + self._items
+        self._size += sum(len(item.raw) for item in items)
+        self._first_added_at = first_added_at
@@ -1,54 +1,160 @@
+import asyncio
 import json
+import time
+import zlib
+
+import aiohttp
+
+from bulk import BulkIndexer
+
+from invalidation import SearchCacheInvalidator
 
 from logger import logger
 
-from aiokafka import AIOKafkaConsumer
-from aiokafka.errors import KafkaError as AsyncKafkaError
+from metrics import (
+    BATCH_SIZE,
+    CONSUMER_LAG,
+    ERRORS,
+    ES_REQUEST_LATENCY,
+    HANDLER_LATENCY,
+    IN_FLIGHT,
+    MESSAGES,
+)
+
+from offsets import OffsetTracker
+
+from aiokafka import AIOKafkaConsumer, ConsumerRebalanceListener, TopicPartition
+from aiokafka.errors import ConsumerStoppedError, KafkaError as AsyncKafkaError
+
+from kafka.admin import KafkaAdminClient, NewPartitions, NewTopic
+from kafka.errors import KafkaError as SyncKafkaError, TopicAlreadyExistsError
+
+from typing import Callable, Any, Dict, List, NamedTuple, Optional, Set
+
+MAX_RETRY_DELAY = 30.0
+
+class _Pending(NamedTuple):
+    """Метка операции в буфере BulkIndexer"""
+
+    tp: TopicPartition
+    offset: int
+    # Поколение партиции в OffsetTracker на момент чтения сообщения
+    generation: int
+    action: str
+    doc_id: str
+
+
+class IndexingLane:
+    """
+    Очередь операций со своим BulkIndexer. Операции с одним id документа
+    всегда попадают в одну очередь, а очередь отправляет пачки строго
+    последовательно, поэтому add/delete одного документа не переставляются.
+    Смещение сообщения хранится вместе с его операцией в буфере BulkIndexer.
+    """
+
+    def __init__(self, indexer: BulkIndexer):
+        self.indexer = indexer
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def add(
+        self,
+        lines: List[Dict[str, Any]],
+        tp: TopicPartition,
+        offset: int,
+        generation: int,
+    ) -> None:
+        action, meta = next(iter(lines[0].items()))
+        pending = _Pending(tp, offset, generation, action, str(meta["_id"]))
+        self.indexer.add(lines, tag=pending)
+        if self.indexer.is_full():
+            self.wake.set()
+
 
-from kafka.admin import KafkaAdminClient, NewTopic
-from kafka.errors import KafkaError as SyncKafkaError
+class _RebalanceListener(ConsumerRebalanceListener):
+    def __init__(self, consumer: "Consumer"):
+        self._owner = consumer
+
+    async def on_partitions_revoked(self, revoked) -> None:
+        await self._owner._commit()
+        self._owner._tracker.forget(revoked)
+        self._owner._discard_stale()
+
+    async def on_partitions_assigned(self, assigned) -> None:
+        pass
 
-from typing import Callable, Awaitable, Any
 
 class Consumer:
-    def __init__(self, topic_name: str, kafka_endpoint: str = "kafka:9094"):
+    def __init__(
+        self,
+        topic_name: str,
+        kafka_endpoint: str = "kafka:9094",
+        group_id: str = "elastic-update-service",
+        num_partitions: int = 1,
+        replication_factor: int = 1,
+        max_in_flight: int = 5000,
+    ):
         self.topic_name = topic_name
-        
-        try:
-            admin_client = KafkaAdminClient(bootstrap_servers=kafka_endpoint)
+        self.max_in_flight = max_in_flight
 
-            topic_list = [
-                NewTopic(
-                    name=topic_name, 
-                    num_partitions=1,
-                    replication_factor=1
-                )
-            ]
-            admin_client.create_topics(
-                new_topics=topic_list,
-                validate_only=False
-            )
-
-            logger.info(f"{topic_name} topic was created!")
+        self._tracker = OffsetTracker()
+        self._lanes: List[IndexingLane] = []
+        self._committed: Dict[TopicPartition, int] = {}
+        self._progress = asyncio.Event()
 
+        try:
+            admin_client = KafkaAdminClient(bootstrap_servers=kafka_endpoint)
+            self._ensure_topic(admin_client, num_partitions, replication_factor)
+            admin_client.close()
         except SyncKafkaError as e1:
             logger.error(f"Can't create {topic_name} topic", exc_info=True)
         finally:
             try:
                 self._consumer = AIOKafkaConsumer(
-                    topic_name,
-                    bootstrap_servers=kafka_endpoint
+                    bootstrap_servers=kafka_endpoint,
+                    group_id=group_id,
+                    enable_auto_commit=False,
+                    auto_offset_reset="earliest",
+                )
+                self._consumer.subscribe(
+                    [topic_name], listener=_RebalanceListener(self)
                 )
             except AsyncKafkaError as e2:
                 logger.error(f"Can't connect to kafka")
 
+    def _ensure_topic(
+        self, admin_client: KafkaAdminClient, num_partitions: int, replication_factor: int
+    ) -> None:
+        try:
+            admin_client.create_topics(
+                new_topics=[
+                    NewTopic(
+                        name=self.topic_name,
+                        num_partitions=num_partitions,
+                        replication_factor=replication_factor
+                    )
+                ],
+                validate_only=False
+            )
+            logger.info(f"{self.topic_name} topic was created!")
+        except TopicAlreadyExistsError:
+            topics = admin_client.describe_topics([self.topic_name])
+            current = len(topics[0]["partitions"]) if topics else num_partitions
+            if current < num_partitions:
+                admin_client.create_partitions(
+                    {self.topic_name: NewPartitions(total_count=num_partitions)}
+                )
+                logger.info(
+                    f"{self.topic_name} topic partitions increased from {current} to {num_partitions}"
+                )
+
     async def start(self) -> None:
         try:
             await self._consumer.start()
             logger.info(f"Consumer of {self.topic_name} topic started")
         except AsyncKafkaError as e:
             logger.error(f"Can't start consumer of {self.topic_name} topic", exc_info=True)
-    
+
     async def stop(self) -> None:
         try:
             await self._consumer.stop()
@@ -56,10 +162,201 @@ class Consumer:
         except AsyncKafkaError as e:
             logger.error(f"Can't stop consumer of {self.topic_name} topic", exc_info=True)
 
-    async def consume(self, handler: Callable[[Any], Awaitable[None]]) -> None:
+    async def consume(
+        self,
+        handler: Callable[[Any, str], List[Dict[str, Any]]],
+        indexers: List[BulkIndexer],
+        invalidator: Optional[SearchCacheInvalidator] = None,
+    ) -> None:
+        """
+        Читает сообщения и раскладывает операции по очередям (по одной на indexer)
+        по хэшу id документа. Очереди отправляют _bulk запросы параллельно.
+        В обработке одновременно не больше max_in_flight сообщений, а смещения
+        коммитятся только до первого еще не отправленного сообщения партиции.
+        """
+        lanes = [IndexingLane(indexer) for indexer in indexers]
+        self._lanes = lanes
+        stopping = False
+
+        def start_lane(lane: IndexingLane) -> None:
+            lane.task = asyncio.create_task(self._run_lane(lane, invalidator))
+            lane.task.add_done_callback(lambda task: on_lane_done(lane, task))
+
+        def on_lane_done(lane: IndexingLane, task: asyncio.Task) -> None:
+            if stopping or task.cancelled():
+                return
+            # Операции и их смещения остаются в буфере, новая задача их дошлет;
+            # без перезапуска смещения партиций перестали бы коммититься
+            ERRORS.labels(self.topic_name, "lane").inc()
+            logger.error(
+                f"Indexing lane of {self.topic_name} topic failed, restarting",
+                exc_info=task.exception(),
+            )
+            start_lane(lane)
+
+        for lane in lanes:
+            start_lane(lane)
+        flush_interval = min(indexer.flush_interval for indexer in indexers)
+        max_records = sum(indexer.max_actions for indexer in indexers)
         try:
-            async for msg in self._consumer:
-                data = json.loads(msg.value)
-                await handler(data, self.topic_name)
+            while True:
+                while self._tracker.pending >= self.max_in_flight:
+                    self._progress.clear()
+                    await self._progress.wait()
+                    await self._commit()
+
+                batches = await self._consumer.getmany(
+                    timeout_ms=int(flush_interval * 1000),
+                    max_records=min(max_records, self.max_in_flight - self._tracker.pending),
+                )
+                for tp, messages in batches.items():
+                    for msg in messages:
+                        generation = self._tracker.add(tp, msg.offset)
+                        lines = self._handle(handler, msg)
+                        if not lines:
+                            self._tracker.done(tp, msg.offset)
+                            continue
+                        doc_id = str(next(iter(lines[0].values()))["_id"])
+                        lane = lanes[zlib.crc32(doc_id.encode("utf-8")) % len(lanes)]
+                        lane.add(lines, tp, msg.offset, generation)
+                    MESSAGES.labels(self.topic_name).inc(len(messages))
+                await self._commit()
+                await self._update_lag()
+        except ConsumerStoppedError:
+            pass
         except AsyncKafkaError as e:
-            logger.error(f"Can't read messages from {self.topic_name} topic", exc_info=True)
\ No newline at end of file
+            logger.error(f"Can't read messages from {self.topic_name} topic", exc_info=True)
+        finally:
+            stopping = True
+            tasks = [lane.task for lane in lanes if lane.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._lanes = []
+
+    def _handle(
+        self, handler: Callable[[Any, str], List[Dict[str, Any]]], msg
+    ) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            data = json.loads(msg.value)
+        except ValueError:
+            logger.error(f"wrong message from topic {self.topic_name}")
+            ERRORS.labels(self.topic_name, "parse").inc()
+            return []
+        lines = handler(data, self.topic_name)
+        HANDLER_LATENCY.labels(self.topic_name).observe(time.perf_counter() - started)
+        if not lines:
+            ERRORS.labels(self.topic_name, "parse").inc()
+        return lines
+
+    async def _run_lane(
+        self, lane: IndexingLane, invalidator: Optional[SearchCacheInvalidator]
+    ) -> None:
+        indexer = lane.indexer
+        while True:
+            try:
+                await asyncio.wait_for(lane.wake.wait(), timeout=indexer.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            lane.wake.clear()
+            if not len(indexer) or not indexer.should_flush():
+                continue
+
+            await self._flush(indexer)
+
+            # Операции, отклоненные с 429, остались в буфере вместе со смещениями
+            done = indexer.pop_done()
+            if not done:
+                continue
+            for pending in done:
+                self._tracker.done(pending.tp, pending.offset, pending.generation)
+            IN_FLIGHT.labels(self.topic_name).set(self._tracker.pending)
+            self._progress.set()
+            if invalidator is not None:
+                await self._invalidate(invalidator, done)
+
+    async def _invalidate(
+        self, invalidator: SearchCacheInvalidator, done: List[_Pending]
+    ) -> None:
+        # Удаленный документ влияет только на результаты, где он был. Добавленный
+        # или измененный может попасть в любой результат и сдвинуть релевантность,
+        # поэтому тогда сбрасывается весь кэш индекса
+        if all(pending.action == "delete" for pending in done):
+            deleted_ids = list(dict.fromkeys(pending.doc_id for pending in done))
+            await invalidator.invalidate(self.topic_name, deleted_ids)
+        else:
+            await invalidator.invalidate(self.topic_name)
+
+    def _is_stale(self, pending: _Pending) -> bool:
+        return pending.generation != self._tracker.generation(pending.tp)
+
+    def _discard_stale(self) -> None:
+        """
+        Убирает из буферов операции партиций, которые забрали при ребалансе:
+        их сообщения заново прочитает новый владелец партиции
+        """
+        for lane in self._lanes:
+            removed = lane.indexer.discard(self._is_stale)
+            if removed:
+                logger.info(
+                    f"{removed} operations of revoked partitions of "
+                    f"{self.topic_name} topic dropped"
+                )
+
+    async def _flush(self, indexer: BulkIndexer) -> None:
+        delay = 0.5
+        while True:
+            # Операции могли вернуться в буфер на повтор уже после ребаланса
+            indexer.discard(self._is_stale)
+            if not len(indexer):
+                return
+            batch_size = len(indexer)
+            started = time.perf_counter()
+            try:
+                failures = await indexer.flush()
+                ES_REQUEST_LATENCY.labels(self.topic_name).observe(time.perf_counter() - started)
+                BATCH_SIZE.labels(self.topic_name).observe(batch_size)
+                for failure in failures:
+                    ERRORS.labels(self.topic_name, failure.action).inc()
+                    logger.error(
+                        f"Can't {failure.action} doc with id = {failure.id} in index "
+                        f"{failure.index}: status {failure.status}, {failure.reason}"
+                    )
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                ERRORS.labels(self.topic_name, "bulk_request").inc()
+                logger.error(f"Bulk request for {self.topic_name} topic failed", exc_info=True)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    async def _commit(self) -> None:
+        offsets = self._tracker.committable()
+        if not offsets:
+            return
+        assigned: Set[TopicPartition] = self._consumer.assignment()
+        offsets = {tp: offset for tp, offset in offsets.items() if tp in assigned}
+        if not offsets:
+            return
+        try:
+            await self._consumer.commit(offsets)
+            self._committed.update(offsets)
+        except AsyncKafkaError as e:
+            ERRORS.labels(self.topic_name, "commit").inc()
+            logger.warning(f"Can't commit offsets of {self.topic_name} topic", exc_info=True)
+
+    async def _update_lag(self) -> None:
+        IN_FLIGHT.labels(self.topic_name).set(self._tracker.pending)
+        for tp in self._consumer.assignment():
+            highwater = self._consumer.highwater(tp)
+            if highwater is None:
+                continue
+            committed = self._committed.get(tp)
+            if committed is None:
+                committed = await self._consumer.committed(tp)
+                if committed is None:
+                    committed = (await self._consumer.beginning_offsets([tp]))[tp]
+                self._committed[tp] = committed
+            CONSUMER_LAG.labels(self.topic_name, str(tp.partition)).set(
+                max(highwater - committed, 0)
+            )
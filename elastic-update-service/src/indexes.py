@@ -0,0 +1,158 @@
+import asyncio
+
+import aiohttp
+
+from es_client import ElasticClient
+
+from logger import logger
+
+from typing import Any, Dict, Optional
+
+
+# Версия схемы индексов. Увеличивается при любом изменении ANALYSIS или MAPPINGS:
+# маппинги существующих индексов обновляются на старте, шаблоны перезаписываются.
+INDEX_VERSION = 2
+
+ANALYSIS = {
+    "analyzer": {
+        "russian_english_analyzer": {
+            "tokenizer": "standard",
+            "filter": [
+                "lowercase",
+                "russian_stemmer",
+                "english_stemmer",
+            ],
+        }
+    },
+    "filter": {
+        "russian_stemmer": {"type": "stemmer", "language": "russian"},
+        "english_stemmer": {"type": "stemmer", "language": "english"},
+    },
+}
+
+TEXT = {"type": "text", "analyzer": "russian_english_analyzer"}
+ID = {"type": "keyword", "index": False}
+
+MAPPINGS = {
+    "products": {
+        "name": TEXT,
+        "id": ID,
+        "category": TEXT,
+        "price_rub": {"type": "long"},
+        "seller_id": {"type": "keyword"},
+    },
+    "sellers": {
+        "name": TEXT,
+        "id": ID,
+    },
+    "comments": {
+        "content": TEXT,
+        "id": ID,
+    },
+}
+
+
+def index_mappings(name: str) -> Dict[str, Any]:
+    return {"_meta": {"version": INDEX_VERSION}, "properties": MAPPINGS[name]}
+
+
+def index_config(name: str) -> Dict[str, Any]:
+    return {"settings": {"analysis": ANALYSIS}, "mappings": index_mappings(name)}
+
+
+INDEX_CONFIGS = {name: index_config(name) for name in MAPPINGS}
+
+
+class IndexSetupError(Exception):
+    pass
+
+
+async def _request(
+    client: ElasticClient, method: str, path: str, body: Optional[Dict[str, Any]] = None
+) -> tuple[int, Dict[str, Any]]:
+    async with client.session.request(method, path, json=body) as response:
+        if method == "HEAD":
+            return response.status, {}
+        return response.status, await response.json()
+
+
+async def ensure_template(client: ElasticClient, name: str) -> None:
+    """Шаблон для версионных индексов (products_v..., см. reindex.py)"""
+    template = f"plotva-{name}"
+    status, body = await _request(client, "GET", f"/_index_template/{template}")
+    if status == 200:
+        current = body["index_templates"][0]["index_template"].get("version", 0)
+        if current >= INDEX_VERSION:
+            return
+    status, body = await _request(
+        client,
+        "PUT",
+        f"/_index_template/{template}",
+        {
+            "index_patterns": [f"{name}_v*"],
+            "version": INDEX_VERSION,
+            "priority": 100,
+            "template": index_config(name),
+        },
+    )
+    if status != 200:
+        raise IndexSetupError(f"can't put template {template}: {body}")
+    logger.info(f"index template {template} updated to version {INDEX_VERSION}")
+
+
+async def ensure_index(client: ElasticClient, name: str) -> None:
+    """Создает индекс, если его нет, или дополняет маппинг устаревшего индекса"""
+    status, _ = await _request(client, "HEAD", f"/{name}")
+    if status == 404:
+        status, body = await _request(client, "PUT", f"/{name}", index_config(name))
+        if status == 200:
+            logger.info(f"{name} index created")
+            return
+        if body.get("error", {}).get("type") != "resource_already_exists_exception":
+            raise IndexSetupError(f"can't create index {name}: {body}")
+
+    status, body = await _request(client, "GET", f"/{name}/_mapping")
+    if status != 200:
+        raise IndexSetupError(f"can't read mapping of {name}: {body}")
+    # name может быть алиасом, тогда ответ содержит конкретные индексы
+    versions = [
+        index["mappings"].get("_meta", {}).get("version", 0) for index in body.values()
+    ]
+    if versions and min(versions) >= INDEX_VERSION:
+        logger.info(f"{name} index is up to date")
+        return
+
+    upgrade_mapping = _request(client, "PUT", f"/{name}/_mapping", index_mappings(name))
+    read_settings = _request(client, "GET", f"/{name}/_settings/index.analysis")
+    (status, body), (_, settings) = await asyncio.gather(upgrade_mapping, read_settings)
+    if status != 200:
+        raise IndexSetupError(f"can't upgrade mapping of {name}: {body}")
+    logger.info(f"{name} index mapping upgraded to version {INDEX_VERSION}")
+
+    for index, index_settings in settings.items():
+        analysis = index_settings.get("settings", {}).get("index", {}).get("analysis")
+        if analysis != ANALYSIS:
+            # Анализаторы открытого индекса не меняются, нужна переиндексация
+            logger.warning(
+                f"analysis settings of {index} differ from the current ones, run reindex.py {name}"
+            )
+
+
+async def init_indexes(
+    client: ElasticClient, retry_delay: float = 1.0, max_retry_delay: float = 30.0
+) -> None:
+    """
+    Готовит шаблоны и индексы всех топиков параллельно.
+    Пока Elasticsearch недоступен, повторяет попытки с растущей задержкой.
+    """
+    while True:
+        try:
+            await asyncio.gather(
+                *(ensure_template(client, name) for name in MAPPINGS),
+                *(ensure_index(client, name) for name in MAPPINGS),
+            )
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.warning(f"elasticsearch is not available, retry in {retry_delay}s")
+        await asyncio.sleep(retry_delay)
+        retry_delay = min(retry_delay * 2, max_retry_delay)
@@ -0,0 +1,52 @@
+import asyncio
+
+import aiohttp
+
+from logger import logger
+
+from typing import List, Optional
+
+
+class SearchCacheInvalidator:
+    """
+    Сообщает search-service, что документы индекса изменились и кэш устарел.
+    token передается в заголовке X-Cache-Invalidate-Token.
+    """
+
+    def __init__(self, url: str, token: str, timeout: float = 2.0):
+        self.url = url
+        self.token = token
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def invalidate(
+        self, index: str, deleted_ids: Optional[List[str]] = None
+    ) -> None:
+        """
+        Сбрасывает кэш индекса. С deleted_ids search-service сбрасывает только
+        результаты, где встречаются эти документы.
+        """
+        if self._session is None:
+            return
+        try:
+            async with self._session.post(
+                self.url,
+                params={"index": index},
+                json={"deleted_ids": deleted_ids} if deleted_ids else None,
+                headers={"X-Cache-Invalidate-Token": self.token},
+            ) as response:
+                if response.status != 200:
+                    logger.warning(
+                        f"Search cache invalidation for index {index} returned {response.status}"
+                    )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.warning(f"Can't invalidate search cache for index {index}", exc_info=True)
@@ -1,17 +1,88 @@
 import asyncio
+import os
 import signal
 
-from handlers import init_indexes, process_topic
+from typing import List, Optional
+
+from bulk import BulkIndexer
+
+from handlers import ES_ENDPOINT, process_topic
 
 from consumer import Consumer
 
+from es_client import ElasticClient
+
+from indexes import init_indexes
+
+from invalidation import SearchCacheInvalidator
+
+from logger import logger
+
+from metrics import start_metrics_server
+
+
+BULK_MAX_ACTIONS = int(os.getenv("BULK_MAX_ACTIONS", "500"))
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(5 * 1024 * 1024)))
+BULK_FLUSH_INTERVAL = float(os.getenv("BULK_FLUSH_INTERVAL", "1.0"))
+SEARCH_CACHE_INVALIDATE_URL = os.getenv("SEARCH_CACHE_INVALIDATE_URL")
+CACHE_INVALIDATE_TOKEN = os.getenv("CACHE_INVALIDATE_TOKEN")
+
+KAFKA_ENDPOINT = os.getenv("KAFKA_ENDPOINT", "kafka:9094")
+KAFKA_GROUP_ID = os.getenv("KAFKA_GROUP_ID", "elastic-update-service")
+KAFKA_NUM_PARTITIONS = int(os.getenv("KAFKA_NUM_PARTITIONS", "1"))
+KAFKA_REPLICATION_FACTOR = int(os.getenv("KAFKA_REPLICATION_FACTOR", "1"))
+KAFKA_MAX_IN_FLIGHT = int(os.getenv("KAFKA_MAX_IN_FLIGHT", "5000"))
+INDEXER_CONCURRENCY = int(os.getenv("INDEXER_CONCURRENCY", "4"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+
+def create_indexers(
+    client: ElasticClient, refresh: Optional[str] = None
+) -> List[BulkIndexer]:
+    return [
+        BulkIndexer(
+            client,
+            max_actions=BULK_MAX_ACTIONS,
+            max_bytes=BULK_MAX_BYTES,
+            flush_interval=BULK_FLUSH_INTERVAL,
+            refresh=refresh,
+        )
+        for _ in range(INDEXER_CONCURRENCY)
+    ]
+
+
+def create_consumer(topic_name: str) -> Consumer:
+    return Consumer(
+        topic_name,
+        kafka_endpoint=KAFKA_ENDPOINT,
+        group_id=KAFKA_GROUP_ID,
+        num_partitions=KAFKA_NUM_PARTITIONS,
+        replication_factor=KAFKA_REPLICATION_FACTOR,
+        max_in_flight=KAFKA_MAX_IN_FLIGHT,
+    )
 
-init_indexes()
 
 async def main():
-    product_consumer = Consumer("products")
-    seller_consumer = Consumer("sellers")
-    comment_consumer = Consumer("comments")
+    start_metrics_server(METRICS_PORT)
+
+    es_client = ElasticClient(ES_ENDPOINT)
+    await es_client.start()
+    await init_indexes(es_client)
+
+    invalidator = None
+    if SEARCH_CACHE_INVALIDATE_URL and not CACHE_INVALIDATE_TOKEN:
+        logger.warning(
+            "CACHE_INVALIDATE_TOKEN is not set, search cache won't be invalidated"
+        )
+    elif SEARCH_CACHE_INVALIDATE_URL:
+        invalidator = SearchCacheInvalidator(
+            SEARCH_CACHE_INVALIDATE_URL, CACHE_INVALIDATE_TOKEN
+        )
+        await invalidator.start()
+
+    product_consumer = create_consumer("products")
+    seller_consumer = create_consumer("sellers")
+    comment_consumer = create_consumer("comments")
 
     await product_consumer.start()
     await seller_consumer.start()
@@ -21,15 +92,26 @@ async def main():
         await product_consumer.stop()
         await seller_consumer.stop()
         await comment_consumer.stop()
-    
+
     loop = asyncio.get_running_loop()
     for sig in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(sig, lambda: asyncio.create_task(stop()))
 
-    await asyncio.gather(
-        product_consumer.consume(process_topic),
-        seller_consumer.consume(process_topic),
-        comment_consumer.consume(process_topic)
-    )
+    # Кэш поиска сбрасывается после _bulk: без wait_for поиск до ближайшего refresh
+    # прочитал бы старое состояние индекса и снова закэшировал его на весь TTL
+    refresh = "wait_for" if invalidator is not None else None
+    try:
+        await asyncio.gather(
+            *(
+                consumer.consume(
+                    process_topic, create_indexers(es_client, refresh), invalidator
+                )
+                for consumer in (product_consumer, seller_consumer, comment_consumer)
+            )
+        )
+    finally:
+        if invalidator is not None:
+            await invalidator.close()
+        await es_client.close()
 
-asyncio.run(main())
\ No newline at end of file
+asyncio.run(main())
@@ -0,0 +1,53 @@
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from logger import logger
+
+
+MESSAGES = Counter(
+    "indexer_messages_total",
+    "Messages read from Kafka",
+    ["topic"],
+)
+
+HANDLER_LATENCY = Histogram(
+    "indexer_handler_seconds",
+    "Time to turn a Kafka message into bulk operations",
+    ["topic"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1),
+)
+
+ES_REQUEST_LATENCY = Histogram(
+    "indexer_es_request_seconds",
+    "Latency of Elasticsearch _bulk requests",
+    ["topic"],
+)
+
+BATCH_SIZE = Histogram(
+    "indexer_bulk_batch_size",
+    "Operations sent in one _bulk request",
+    ["topic"],
+    buckets=(1, 5, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+
+ERRORS = Counter(
+    "indexer_errors_total",
+    "Indexing errors by action (index, delete, bulk_request, parse, commit)",
+    ["topic", "action"],
+)
+
+CONSUMER_LAG = Gauge(
+    "indexer_consumer_lag",
+    "Messages in the partition that are not committed yet",
+    ["topic", "partition"],
+)
+
+IN_FLIGHT = Gauge(
+    "indexer_in_flight_messages",
+    "Messages read from Kafka but not flushed to Elasticsearch yet",
+    ["topic"],
+)
+
+
+def start_metrics_server(port: int) -> None:
+    start_http_server(port)
+    logger.info(f"Metrics are served on port {port}")
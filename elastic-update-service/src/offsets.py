@@ -0,0 +1,66 @@
+from collections import deque
+
+from aiokafka import TopicPartition
+
+from typing import Deque, Dict, Iterable, List, Optional
+
+
+class OffsetTracker:
+    """
+    Следит за сообщениями, которые обрабатываются параллельно.
+
+    Для каждой партиции коммитить можно только смещение, до которого все
+    сообщения уже обработаны, даже если более поздние завершились раньше.
+
+    forget увеличивает поколение партиции: done с поколением, полученным
+    до ребаланса, игнорируется, даже если то же смещение прочитано заново.
+    """
+
+    def __init__(self):
+        self._pending: Dict[TopicPartition, Deque[List]] = {}
+        self._entries: Dict[TopicPartition, Dict[int, List]] = {}
+        self._generations: Dict[TopicPartition, int] = {}
+        self._count = 0
+
+    @property
+    def pending(self) -> int:
+        return self._count
+
+    def generation(self, tp: TopicPartition) -> int:
+        return self._generations.get(tp, 0)
+
+    def add(self, tp: TopicPartition, offset: int) -> int:
+        """Добавляет сообщение и возвращает текущее поколение партиции"""
+        entry = [offset, False]
+        self._pending.setdefault(tp, deque()).append(entry)
+        self._entries.setdefault(tp, {})[offset] = entry
+        self._count += 1
+        return self.generation(tp)
+
+    def done(
+        self, tp: TopicPartition, offset: int, generation: Optional[int] = None
+    ) -> None:
+        if generation is not None and generation != self.generation(tp):
+            return
+        entry = self._entries.get(tp, {}).pop(offset, None)
+        if entry is not None:
+            entry[1] = True
+            self._count -= 1
+
+    def committable(self) -> Dict[TopicPartition, int]:
+        """Смещения для коммита по партициям, где продвинулась граница обработанных"""
+        offsets = {}
+        for tp, queue in self._pending.items():
+            last = None
+            while queue and queue[0][1]:
+                last = queue.popleft()[0]
+            if last is not None:
+                offsets[tp] = last + 1
+        return offsets
+
+    def forget(self, partitions: Iterable[TopicPartition]) -> None:
+        """Забывает партиции, которые забрали у этого консьюмера при ребалансе"""
+        for tp in partitions:
+            self._pending.pop(tp, None)
+            self._count -= len(self._entries.pop(tp, {}))
+            self._generations[tp] = self.generation(tp) + 1
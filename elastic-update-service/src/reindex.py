@@ -0,0 +1,253 @@
+"""
+Полная переиндексация из PostgreSQL в Elasticsearch без простоя поиска.
+
+Для каждого индекса создается новый версионный индекс (например products_v20250601120000)
+с выключенным refresh и без реплик, строки из PostgreSQL читаются серверным курсором
+и загружаются через _bulk несколькими воркерами. После загрузки настройки
+возвращаются, а алиас с именем индекса атомарно переключается на новый индекс.
+
+Изменения, попавшие в PostgreSQL после начала чтения, в новый индекс не попадут:
+события Kafka за время загрузки пишутся в старый индекс через алиас. Чтобы их
+подхватить, запустите переиндексацию повторно или перечитайте топики с момента старта.
+
+Запуск:
+    python src/reindex.py products sellers comments --workers 4 --batch-size 1000
+"""
+import argparse
+import asyncio
+import copy
+import os
+import time
+
+import aiohttp
+import asyncpg
+
+from bulk import BulkIndexer
+
+from es_client import ElasticClient
+
+from handlers import ES_ENDPOINT
+
+from indexes import INDEX_CONFIGS
+
+from logger import logger
+
+from typing import Any, Dict, List, Optional
+
+
+POSTGRES_DSN = (
+    f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}"
+    f"@{os.getenv('POSTGRES_HOST')}:{os.getenv('POSTGRES_PORT', '5432')}/{os.getenv('POSTGRES_DB')}"
+)
+
+SOURCE_QUERIES = {
+    "products": """
+        SELECT product_id::text AS id, name, category, price_rub, seller_id::text AS seller_id
+        FROM plotva.products
+    """,
+    "sellers": """
+        SELECT seller_id::text AS id, name
+        FROM plotva.sellers
+    """,
+    "comments": """
+        SELECT comment_id::text AS id, content
+        FROM plotva.comments
+    """,
+}
+
+LOAD_SETTINGS = {"index": {"number_of_replicas": 0, "refresh_interval": "-1"}}
+
+
+class ReindexError(Exception):
+    pass
+
+
+async def es_request(
+    client: ElasticClient, method: str, path: str, body: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    async with client.session.request(method, path, json=body) as response:
+        result = await response.json()
+        if response.status >= 300:
+            raise ReindexError(f"{method} {path} failed with status {response.status}: {result}")
+        return result
+
+
+async def create_versioned_index(client: ElasticClient, alias: str) -> str:
+    name = f"{alias}_v{time.strftime('%Y%m%d%H%M%S', time.gmtime())}"
+    config = copy.deepcopy(INDEX_CONFIGS[alias])
+    config["settings"].update(LOAD_SETTINGS)
+    await es_request(client, "PUT", f"/{name}", config)
+    logger.info(f"index {name} created for alias {alias}")
+    return name
+
+
+async def read_rows(
+    pool: asyncpg.Pool,
+    query: str,
+    batch_size: int,
+    queue: asyncio.Queue,
+    workers: int,
+) -> int:
+    """Читает строки серверным курсором и кладет их в очередь пачками"""
+    total = 0
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                batch: List[Dict[str, Any]] = []
+                async for record in conn.cursor(query, prefetch=batch_size):
+                    batch.append(dict(record))
+                    if len(batch) >= batch_size:
+                        await queue.put(batch)
+                        total += len(batch)
+                        batch = []
+                if batch:
+                    await queue.put(batch)
+                    total += len(batch)
+    finally:
+        for _ in range(workers):
+            await queue.put(None)
+    return total
+
+
+async def load_worker(
+    client: ElasticClient, index_name: str, queue: asyncio.Queue, batch_size: int
+) -> int:
+    """Отправляет пачки строк в _bulk и возвращает количество отклоненных документов"""
+    indexer = BulkIndexer(client, max_actions=batch_size)
+    failed = 0
+    while True:
+        batch = await queue.get()
+        if batch is None:
+            return failed
+        for row in batch:
+            indexer.add([{"index": {"_index": index_name, "_id": row["id"]}}, row])
+        while len(indexer):
+            failures = await indexer.flush()
+            for failure in failures:
+                if failure.status != 429:
+                    failed += 1
+                    logger.error(
+                        f"doc with id = {failure.id} rejected by {index_name}: {failure.reason}"
+                    )
+            if len(indexer):
+                await asyncio.sleep(1)
+
+
+async def swap_alias(client: ElasticClient, alias: str, new_index: str, delete_old: bool) -> None:
+    """
+    Одним запросом в _aliases переключает алиас на новый индекс. Индекс, созданный
+    до перехода на алиасы под тем же именем, удаляется в том же запросе.
+    """
+    actions: List[Dict[str, Any]] = []
+    old_indexes: List[str] = []
+    async with client.session.get(f"/_alias/{alias}") as response:
+        if response.status == 200:
+            old_indexes = list((await response.json()).keys())
+    async with client.session.head(f"/{alias}") as response:
+        concrete_exists = not old_indexes and response.status == 200
+
+    if concrete_exists:
+        actions.append({"remove_index": {"index": alias}})
+    for index in old_indexes:
+        actions.append({"remove": {"index": index, "alias": alias}})
+    actions.append({"add": {"index": new_index, "alias": alias}})
+
+    await es_request(client, "POST", "/_aliases", {"actions": actions})
+    logger.info(f"alias {alias} switched to {new_index}")
+
+    if delete_old:
+        for index in old_indexes:
+            await es_request(client, "DELETE", f"/{index}")
+            logger.info(f"old index {index} deleted")
+
+
+async def reindex(
+    client: ElasticClient,
+    pool: asyncpg.Pool,
+    alias: str,
+    workers: int,
+    batch_size: int,
+    replicas: int,
+    delete_old: bool,
+) -> None:
+    started = time.monotonic()
+    new_index = await create_versioned_index(client, alias)
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    reader = asyncio.create_task(
+        read_rows(pool, SOURCE_QUERIES[alias], batch_size, queue, workers)
+    )
+    loaders = [
+        asyncio.create_task(load_worker(client, new_index, queue, batch_size))
+        for _ in range(workers)
+    ]
+    try:
+        await asyncio.gather(reader, *loaders)
+    except BaseException:
+        for task in (reader, *loaders):
+            task.cancel()
+        raise
+    total = reader.result()
+    failed = sum(loader.result() for loader in loaders)
+
+    if failed:
+        raise ReindexError(f"{failed} docs were rejected by {new_index}, alias {alias} is not switched")
+
+    await es_request(
+        client,
+        "PUT",
+        f"/{new_index}/_settings",
+        {"index": {"number_of_replicas": replicas, "refresh_interval": None}},
+    )
+    await es_request(client, "POST", f"/{new_index}/_refresh")
+    await swap_alias(client, alias, new_index, delete_old)
+    logger.info(
+        f"{total} docs reindexed into {new_index} in {time.monotonic() - started:.1f}s"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Reindex PostgreSQL tables into Elasticsearch")
+    # choices с nargs="*" отвергает пустой список аргументов, поэтому проверяем сами
+    parser.add_argument(
+        "indexes", nargs="*", metavar="index", help=f"one of {', '.join(SOURCE_QUERIES)}"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--replicas", type=int, default=1)
+    parser.add_argument("--delete-old", action="store_true")
+    args = parser.parse_args()
+
+    unknown = [alias for alias in args.indexes if alias not in SOURCE_QUERIES]
+    if unknown:
+        parser.error(f"unknown indexes: {', '.join(unknown)}")
+    indexes = args.indexes or list(SOURCE_QUERIES)
+
+    client = ElasticClient(ES_ENDPOINT, request_timeout=300)
+    await client.start()
+    pool = await asyncpg.create_pool(POSTGRES_DSN, min_size=1, max_size=len(indexes))
+    try:
+        await asyncio.gather(
+            *(
+                reindex(
+                    client,
+                    pool,
+                    alias,
+                    workers=args.workers,
+                    batch_size=args.batch_size,
+                    replicas=args.replicas,
+                    delete_old=args.delete_old,
+                )
+                for alias in indexes
+            )
+        )
+    except (ReindexError, aiohttp.ClientError, asyncio.TimeoutError):
+        logger.error("reindex failed", exc_info=True)
+        raise SystemExit(1)
+    finally:
+        await pool.close()
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+-- +goose Up
+-- +goose StatementBegin
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS plotva.user_addresses (
+    address_id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES plotva.users (user_id),
+    country VARCHAR(255) NOT NULL,
+    settlement VARCHAR(255) NOT NULL,
+    street VARCHAR(255) NOT NULL,
+    house_number VARCHAR(32) NOT NULL,
+    apartment_number VARCHAR(32) NOT NULL,
+    extra_info TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_addresses_user_id ON plotva.user_addresses (user_id);
+
+CREATE TABLE IF NOT EXISTS plotva.orders (
+    order_id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES plotva.users (user_id),
+    address_id UUID NOT NULL REFERENCES plotva.user_addresses (address_id),
+    status VARCHAR(32) NOT NULL,
+    order_date TIMESTAMP NOT NULL DEFAULT NOW(),
+    shipped_date TIMESTAMP NOT NULL,
+    total_cost_rub BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS plotva.order_entries (
+    entry_id BIGSERIAL PRIMARY KEY,
+    order_id UUID NOT NULL REFERENCES plotva.orders (order_id),
+    product_id UUID NOT NULL REFERENCES plotva.products (product_id),
+    quantity INTEGER NOT NULL,
+    product_name VARCHAR(255) NOT NULL,
+    product_price_rub BIGINT NOT NULL,
+    product_seller_id UUID NOT NULL,
+    product_seller_name VARCHAR(255) NOT NULL
+);
+
+END;
+
+-- +goose StatementEnd
+
+-- +goose Down
+-- +goose StatementBegin
+
+BEGIN;
+
+DROP TABLE IF EXISTS plotva.order_entries CASCADE;
+DROP TABLE IF EXISTS plotva.orders CASCADE;
+DROP TABLE IF EXISTS plotva.user_addresses CASCADE;
+
+END;
+
+-- +goose StatementEnd
@@ -0,0 +1,18 @@
+-- +goose NO TRANSACTION
+-- Индексы строятся CONCURRENTLY, чтобы не блокировать запись в заказы,
+-- поэтому миграция выполняется вне транзакции.
+
+-- +goose Up
+
+-- История заказов пользователя: keyset пагинация по (order_date, order_id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_user_id_order_date
+    ON plotva.orders (user_id, order_date DESC, order_id DESC);
+
+-- Позиции заказа и их количество в сводке истории
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_order_entries_order_id
+    ON plotva.order_entries (order_id);
+
+-- +goose Down
+
+DROP INDEX CONCURRENTLY IF EXISTS plotva.idx_order_entries_order_id;
+DROP INDEX CONCURRENTLY IF EXISTS plotva.idx_orders_user_id_order_date;
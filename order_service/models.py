@@ -1,4 +1,5 @@
 import enum
+from typing import Dict, FrozenSet, List, Tuple
 
 
 class OrderStatus(enum.Enum):
@@ -7,3 +8,33 @@ class OrderStatus(enum.Enum):
     SHIPPED = "shipped"
     DELIVERED = "delivered"
     CANCELLED = "cancelled"
+
+
+# Допустимые переходы статусов заказа; delivered и cancelled - конечные
+ORDER_STATUS_TRANSITIONS: Dict[OrderStatus, FrozenSet[OrderStatus]] = {
+    OrderStatus.PENDING: frozenset({OrderStatus.PROCESSING, OrderStatus.CANCELLED}),
+    OrderStatus.PROCESSING: frozenset({OrderStatus.SHIPPED, OrderStatus.CANCELLED}),
+    OrderStatus.SHIPPED: frozenset({OrderStatus.DELIVERED}),
+    OrderStatus.DELIVERED: frozenset(),
+    OrderStatus.CANCELLED: frozenset(),
+}
+
+
+def can_transition(current: OrderStatus, new: OrderStatus) -> bool:
+    """Повторная установка текущего статуса тоже допустима (идемпотентный повтор)"""
+    return current == new or new in ORDER_STATUS_TRANSITIONS[current]
+
+
+def statuses_allowed_before(new: OrderStatus) -> List[str]:
+    """Статусы, из которых можно перейти в new"""
+    return [status.value for status in OrderStatus if can_transition(status, new)]
+
+
+def transition_pairs() -> List[Tuple[str, str]]:
+    """Все допустимые пары (из статуса, в статус), включая повтор текущего"""
+    return [
+        (current.value, new.value)
+        for current in OrderStatus
+        for new in OrderStatus
+        if can_transition(current, new)
+    ]
@@ -1,5 +1,6 @@
 import uuid
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from database.connection import get_db_session
 from schemas import api
@@ -7,6 +8,7 @@ from schemas import repositories
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 from utils.tracer import Tracer
+from utils.cache import LocalCache, OrderDetailsCache
 import os
 
 logger = logging.getLogger(__name__)
@@ -19,6 +21,15 @@ main_tracer = Tracer(
     service_name="order_service", otlp_endpoint=OLTP_ENDPOINT
 )
 
+# ORDER_CACHE_SHARED=local включает локальную замену общего кэша (redis),
+# чтобы проверить двухуровневую схему без внешних сервисов
+order_details_cache = OrderDetailsCache(
+    ttl=int(os.getenv("ORDER_CACHE_TTL", "30")),
+    max_entries=int(os.getenv("ORDER_CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.getenv("ORDER_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    shared=LocalCache() if os.getenv("ORDER_CACHE_SHARED") == "local" else None,
+)
+
 
 @api_router.post("/user/{user_id}/order/create")
 async def create_order(
@@ -48,13 +59,6 @@ async def create_order(
         logger.info(f"Creating order for user {user_id} with data: {data.model_dump()}")
         async with session.begin():
             try:
-                logger.debug(f"Checking if user {user_id} exists")
-                if not await repositories.UsersModel.check_user(user_id, session):
-                    logger.warning(f"User {user_id} not found")
-                    return api.CreateOrderResponse(
-                        error_message="Пользователь не найден"
-                    )
-
                 logger.debug(f"Creating order with products: {data.product_ids_list}")
                 order = await repositories.OrdersModel.create_order(
                     user_id=user_id,
@@ -70,6 +74,11 @@ async def create_order(
                 logger.info(f"Order created successfully: {order.order_id}")
                 return api.CreateOrderResponse(order_id=order.order_id)
 
+            except repositories.UserNotFoundError:
+                logger.warning(f"User {user_id} not found")
+                return api.CreateOrderResponse(
+                    error_message="Пользователь не найден"
+                )
             except ValueError as e:
                 logger.error(f"Validation error creating order: {str(e)}")
                 span.record_exception(e)
@@ -86,32 +95,57 @@ async def create_order(
 
 @api_router.get("/user/{user_id}/orders")
 async def get_user_orders(
-    user_id: uuid.UUID, session: AsyncSession = Depends(get_db_session)
+    user_id: uuid.UUID,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    summary: bool = False,
+    session: AsyncSession = Depends(get_db_session),
 ):
     """
-    Получает список всех заказов пользователя.
+    Получает страницу заказов пользователя, от новых к старым.
 
     Args:
         user_id: UUID пользователя
+        limit: Количество заказов на странице
+        cursor: next_cursor из ответа с предыдущей страницей
+        fields: Список полей через запятую (по умолчанию все)
+        summary: Добавить к заказам entries_count и items_count
         session: Асинхронная сессия базы данных
 
     Returns:
-        OrderResponse со списком заказов или сообщением об ошибке
+        OrderResponse со списком заказов и next_cursor или сообщением об ошибке
+
+    Raises:
+        HTTPException 400: При некорректном курсоре или неизвестных полях
     """
     with main_tracer.opentelemetry_tracer.start_as_current_span(
         "get_user_orders"
     ) as span:
         span.set_attribute("user_id", str(user_id))
+        span.set_attribute("limit", limit)
+        span.set_attribute("summary", summary)
 
         logger.info(f"Fetching orders for user {user_id}")
         try:
             logger.debug("Executing get_user_orders query")
-            orders = await repositories.OrdersModel.get_user_orders(session, user_id)
+            orders, next_cursor = await repositories.OrdersModel.get_user_orders(
+                session,
+                user_id,
+                limit=limit,
+                cursor=cursor,
+                fields=fields.split(",") if fields else None,
+                summary=summary,
+            )
 
             span.set_attribute("orders_count", len(orders))
             logger.debug(f"Found {len(orders)} orders")
-            return api.OrderResponse(order_data=orders)
+            return api.OrderResponse(order_data=orders, next_cursor=next_cursor)
 
+        except ValueError as e:
+            logger.warning(f"Invalid orders page request: {str(e)}")
+            span.record_exception(e)
+            raise HTTPException(status_code=400, detail=str(e))
         except SQLAlchemyError as e:
             logger.error(f"Database error fetching orders: {str(e)}", exc_info=True)
             span.record_exception(e)
@@ -145,22 +179,32 @@ async def get_order_details(
 
         logger.info(f"Fetching details for order {order_id}")
         try:
-            logger.debug("Executing get_order query")
-            order_obj = await repositories.OrdersModel.get_order(
-                session=session, order_id=order_id
+
+            async def load_order() -> Optional[bytes]:
+                logger.debug("Executing get_order query")
+                order_obj = await repositories.OrdersModel.get_order(
+                    session=session, order_id=order_id
+                )
+                if not order_obj:
+                    return None
+
+                logger.debug("Serializing order data")
+                order_data = order_obj.to_dict()
+                order_data["entries"] = [entry.to_dict() for entry in order_obj.entries]
+                response = api.OrderResponse(order_data=order_data)
+                return response.model_dump_json().encode()
+
+            content, cached = await order_details_cache.get_or_load(
+                order_id, load_order
             )
+            span.set_attribute("cache_hit", cached)
 
-            if not order_obj:
+            if content is None:
                 logger.warning(f"Order {order_id} not found")
                 return api.OrderResponse(error_message="Order not found")
 
-            logger.debug("Serializing order data")
-            order_data = order_obj.to_dict()
-            order_data["entries"] = [entry.to_dict() for entry in order_obj.entries]
-
-            span.set_attribute("order_status", order_data.get("status", "unknown"))
             logger.info(f"Successfully retrieved order {order_id}")
-            return api.OrderResponse(order_data=order_data)
+            return Response(content=content, media_type="application/json")
 
         except SQLAlchemyError as e:
             logger.error(f"Database error fetching order: {str(e)}", exc_info=True)
@@ -193,14 +237,15 @@ async def update_order_status(
         "update_order_status"
     ) as span:
         span.set_attribute("order_id", str(order_id))
-        span.set_attribute("new_status", data.new_status)
+        span.set_attribute("new_status", data.new_status.value)
 
         logger.info(f"Updating status for order {order_id} to {data.new_status}")
         async with session.begin():
             try:
-                logger.debug(f"Fetching order {order_id}")
-                order_obj = await repositories.OrdersModel.get_order(session, order_id)
-                if not order_obj:
+                new_status = await repositories.OrdersModel.transition_status(
+                    session, order_id, data.new_status
+                )
+                if new_status is None:
                     logger.warning(f"Order {order_id} not found for status update")
                     return api.SetStatusResponse(
                         error_message=f"Заказ с ID {order_id} не найден",
@@ -208,20 +253,24 @@ async def update_order_status(
                         updated_order_id=None,
                     )
 
-                logger.debug(
-                    f"Current status: {order_obj.status}, new status: {data.new_status}"
-                )
-                await order_obj.update_status(session, status=data.new_status)
-
                 logger.info(f"Status updated successfully for order {order_id}")
-                print(order_obj.status)
                 await session.commit()
+                await order_details_cache.invalidate(order_id)
                 return api.SetStatusResponse(
-                    status=data.new_status,
+                    status=new_status.value,
                     updated_order_id=order_id,
                     error_message=None,
                 )
 
+            except repositories.InvalidStatusTransitionError as e:
+                logger.warning(f"Rejected status update for order {order_id}: {e}")
+                span.record_exception(e)
+                return api.SetStatusResponse(
+                    error_message=str(e),
+                    status=e.current.value,
+                    updated_order_id=None,
+                )
+
             except SQLAlchemyError as e:
                 logger.error(
                     f"Database error updating order {order_id}: {str(e)}", exc_info=True
@@ -248,6 +297,71 @@ async def update_order_status(
                 )
 
 
+@api_router.post("/orders/status/bulk")
+async def bulk_update_order_status(
+    data: api.BulkSetStatusRequest,
+    session: AsyncSession = Depends(get_db_session),
+):
+    """
+    Меняет статусы пачки заказов в одной транзакции одним запросом.
+
+    Переходы проверяются так же, как в update_order_status; отклоненный
+    переход или ненайденный заказ не отменяют остальные изменения.
+
+    Args:
+        data: Список пар (order_id, new_status)
+        session: Асинхронная сессия базы данных
+
+    Returns:
+        BulkSetStatusResponse с результатом по каждому заказу в порядке запроса
+
+    Raises:
+        HTTPException 400: Если заказ указан в пачке несколько раз
+        HTTPException 500: При ошибках базы данных
+    """
+    with main_tracer.opentelemetry_tracer.start_as_current_span(
+        "bulk_update_order_status"
+    ) as span:
+        span.set_attribute("updates_count", len(data.updates))
+
+        logger.info(f"Updating status for {len(data.updates)} orders")
+        async with session.begin():
+            try:
+                results = await repositories.OrdersModel.transition_statuses(
+                    session,
+                    [(update.order_id, update.new_status) for update in data.updates],
+                )
+                await session.commit()
+
+                updated_ids = [
+                    result["order_id"] for result in results if result["updated"]
+                ]
+                for order_id in updated_ids:
+                    await order_details_cache.invalidate(order_id)
+
+                span.set_attribute("updated_count", len(updated_ids))
+                logger.info(
+                    f"Status updated for {len(updated_ids)} of {len(results)} orders"
+                )
+                return api.BulkSetStatusResponse(
+                    results=[api.OrderStatusResult(**result) for result in results],
+                    updated_count=len(updated_ids),
+                )
+
+            except ValueError as e:
+                logger.warning(f"Invalid bulk status update: {str(e)}")
+                span.record_exception(e)
+                await session.rollback()
+                raise HTTPException(status_code=400, detail=str(e))
+            except SQLAlchemyError as e:
+                logger.error(
+                    f"Database error in bulk status update: {str(e)}", exc_info=True
+                )
+                span.record_exception(e)
+                await session.rollback()
+                raise HTTPException(status_code=500, detail="Database error")
+
+
 @api_router.delete("/orders/{order_id}/delete")
 async def delete_order(
     order_id: uuid.UUID, session: AsyncSession = Depends(get_db_session)
@@ -279,6 +393,7 @@ async def delete_order(
 
                 await order_obj.delete_order(session, order_id)
                 await session.commit()
+                await order_details_cache.invalidate(order_id)
                 logger.info(f"Order {order_id} deleted successfully")
                 return api.DeleteOrderResponse(error_message="", order_id=order_id)
 
@@ -330,10 +445,13 @@ async def update_order(
                     session, order_id, update_data
                 )
 
+            except repositories.InvalidStatusTransitionError as e:
+                await session.rollback()
+                logger.warning(f"Rejected update of order {order_id}: {e}")
+                span.record_exception(e)
                 return api.UpdateOrderResponse(
-                    updated_fields=updated_fields, error_message=None
+                    error_message=str(e), updated_fields=[], new_status=None
                 )
-
             except SQLAlchemyError as e:
                 await session.rollback()
                 logger.error(f"Database error: {str(e)}", exc_info=True)
@@ -350,3 +468,18 @@ async def update_order(
                     updated_fields=[],
                     new_status=None,
                 )
+
+        # Сбрасываем кэш только после коммита, иначе параллельное чтение
+        # успеет закэшировать заказ в состоянии до изменения
+        await order_details_cache.invalidate(order_id)
+        return api.UpdateOrderResponse(
+            updated_fields=updated_fields,
+            new_status=update_data.get("status"),
+            error_message=None,
+        )
+
+
+@api_router.get("/cache/orders/stats")
+async def order_cache_stats():
+    """Счетчики кэша деталей заказов: попадания, промахи, hit_ratio, размер"""
+    return order_details_cache.stats()
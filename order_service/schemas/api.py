@@ -1,6 +1,6 @@
 from typing import List, Optional, Union
 from uuid import UUID
-from pydantic import BaseModel as PydanticBaseModel
+from pydantic import BaseModel as PydanticBaseModel, Field
 from datetime import datetime
 from models import OrderStatus
 
@@ -27,6 +27,7 @@ class CreateOrderResponse(BaseResponse):
 
 class OrderResponse(BaseResponse):
     order_data: Optional[Union[dict, List[dict]]] = None
+    next_cursor: Optional[str] = None
 
 
 class SetStatusRequest(BaseRequest):
@@ -39,6 +40,32 @@ class SetStatusResponse(BaseResponse):
     updated_order_id: Optional[UUID] = None
 
 
+BULK_STATUS_MAX_UPDATES = 1000
+
+
+class OrderStatusUpdate(PydanticBaseModel):
+    order_id: UUID
+    new_status: OrderStatus
+
+
+class BulkSetStatusRequest(BaseRequest):
+    updates: List[OrderStatusUpdate] = Field(
+        min_length=1, max_length=BULK_STATUS_MAX_UPDATES
+    )
+
+
+class OrderStatusResult(PydanticBaseModel):
+    order_id: UUID
+    updated: bool
+    status: Optional[str] = None
+    error_message: Optional[str] = None
+
+
+class BulkSetStatusResponse(BaseResponse):
+    results: List[OrderStatusResult] = []
+    updated_count: int = 0
+
+
 class DeleteOrderResponse(BaseResponse):
     order_id: UUID
 
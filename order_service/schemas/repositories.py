@@ -1,14 +1,195 @@
+import base64
 from datetime import datetime
-from typing import List
-from sqlalchemy import ForeignKey, Integer, BigInteger, delete, select, text
+from typing import List, Optional, Sequence, Tuple
+from sqlalchemy import (
+    ForeignKey,
+    Index,
+    Integer,
+    BigInteger,
+    String,
+    any_,
+    bindparam,
+    delete,
+    exists,
+    func,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship, selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID, uuid4
-from models import OrderStatus
+from models import (
+    OrderStatus,
+    can_transition,
+    statuses_allowed_before,
+    transition_pairs,
+)
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
 
 
+class UserNotFoundError(ValueError):
+    pass
+
+
+class InvalidStatusTransitionError(ValueError):
+    def __init__(self, current: OrderStatus, new: OrderStatus):
+        super().__init__(
+            f"Недопустимый переход статуса: {current.value} -> {new.value}"
+        )
+        self.current = current
+        self.new = new
+
+
+# Заказ создается одним запросом: позиции разворачиваются из массивов в порядке
+# запроса (WITH ORDINALITY), товары и продавцы подтягиваются join'ом, а заказ и
+# все позиции вставляются только если найдены пользователь и каждый товар.
+# Итоговый SELECT при неудаче сообщает, чего не хватило.
+_CREATE_ORDER_SQL = text(
+    """
+    WITH requested AS (
+        SELECT r.product_id, r.quantity, r.position
+        FROM unnest(:product_ids, :amounts)
+            WITH ORDINALITY AS r(product_id, quantity, position)
+    ),
+    resolved AS (
+        SELECT
+            requested.position,
+            requested.product_id,
+            requested.quantity,
+            p.name AS product_name,
+            p.price_rub,
+            p.seller_id,
+            s.name AS seller_name
+        FROM requested
+        JOIN plotva.products p ON p.product_id = requested.product_id
+        JOIN plotva.sellers s ON s.seller_id = p.seller_id
+    ),
+    checks AS (
+        SELECT
+            EXISTS (SELECT 1 FROM plotva.users WHERE user_id = :user_id)
+                AS user_exists,
+            ARRAY(
+                SELECT requested.product_id FROM requested
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM resolved
+                    WHERE resolved.position = requested.position
+                )
+                ORDER BY requested.position
+            ) AS missing_product_ids
+    ),
+    new_order AS (
+        INSERT INTO plotva.orders (
+            order_id, user_id, address_id, status,
+            order_date, shipped_date, total_cost_rub
+        )
+        SELECT
+            :order_id, :user_id, :address_id, :status,
+            :order_date, :shipped_date,
+            (SELECT COALESCE(SUM(price_rub * quantity), 0) FROM resolved)
+        FROM checks
+        WHERE checks.user_exists AND cardinality(checks.missing_product_ids) = 0
+        RETURNING order_id, total_cost_rub
+    ),
+    new_entries AS (
+        INSERT INTO plotva.order_entries (
+            order_id, product_id, quantity, product_name,
+            product_price_rub, product_seller_id, product_seller_name
+        )
+        SELECT
+            new_order.order_id, resolved.product_id, resolved.quantity,
+            resolved.product_name, resolved.price_rub, resolved.seller_id,
+            resolved.seller_name
+        FROM new_order CROSS JOIN resolved
+        ORDER BY resolved.position
+        RETURNING entry_id
+    )
+    SELECT
+        new_order.order_id,
+        new_order.total_cost_rub,
+        (SELECT count(*) FROM new_entries) AS entries_count,
+        checks.user_exists,
+        checks.missing_product_ids
+    FROM checks LEFT JOIN new_order ON TRUE
+    """
+).bindparams(
+    bindparam("product_ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("amounts", type_=ARRAY(Integer)),
+    bindparam("user_id", type_=PG_UUID(as_uuid=True)),
+    bindparam("order_id", type_=PG_UUID(as_uuid=True)),
+    bindparam("address_id", type_=PG_UUID(as_uuid=True)),
+)
+
+
+# Пакетная смена статусов одним запросом. Строки блокируются в порядке order_id,
+# чтобы параллельные пакеты с пересекающимися заказами не ловили взаимоблокировку.
+# Допустимость перехода проверяется по таблице пар из ORDER_STATUS_TRANSITIONS.
+# Итоговый SELECT видит заказы до UPDATE, поэтому для отклоненных строк
+# current_status - текущий статус, а NULL - заказ не найден.
+_BULK_STATUS_SQL = text(
+    """
+    WITH requested AS (
+        SELECT r.order_id, r.new_status, r.position
+        FROM unnest(:order_ids, :statuses)
+            WITH ORDINALITY AS r(order_id, new_status, position)
+    ),
+    transitions AS (
+        SELECT t.from_status, t.to_status
+        FROM unnest(:from_statuses, :to_statuses) AS t(from_status, to_status)
+    ),
+    locked AS (
+        SELECT o.order_id, o.status
+        FROM plotva.orders o
+        WHERE o.order_id = ANY(:order_ids)
+        ORDER BY o.order_id
+        FOR UPDATE
+    ),
+    updated AS (
+        UPDATE plotva.orders o
+        SET status = requested.new_status
+        FROM requested
+        JOIN locked ON locked.order_id = requested.order_id
+        JOIN transitions
+            ON transitions.from_status = locked.status
+            AND transitions.to_status = requested.new_status
+        WHERE o.order_id = requested.order_id
+        RETURNING o.order_id
+    )
+    SELECT
+        requested.order_id,
+        requested.new_status,
+        updated.order_id IS NOT NULL AS updated,
+        locked.status AS current_status
+    FROM requested
+    LEFT JOIN updated ON updated.order_id = requested.order_id
+    LEFT JOIN locked ON locked.order_id = requested.order_id
+    ORDER BY requested.position
+    """
+).bindparams(
+    bindparam("order_ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("statuses", type_=ARRAY(String)),
+    bindparam("from_statuses", type_=ARRAY(String)),
+    bindparam("to_statuses", type_=ARRAY(String)),
+)
+
+
+def encode_order_cursor(order_date: datetime, order_id: UUID) -> str:
+    """Курсор следующей страницы истории заказов: позиция последнего заказа"""
+    raw = f"{order_date.isoformat()}|{order_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_order_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        order_date, order_id = base64.urlsafe_b64decode(cursor).decode().split("|")
+        return datetime.fromisoformat(order_date), UUID(order_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Некорректный курсор") from e
+
+
 class BaseModel(AsyncAttrs, DeclarativeBase):
     __table_args__ = {"schema": "plotva"}
 
@@ -156,12 +337,9 @@ class UsersModel(BaseModel):
     @classmethod
     async def check_user(cls, user_id: UUID, session: AsyncSession):
         result = await session.execute(
-            select(UsersModel).filter(UsersModel.user_id == user_id)
+            select(exists().where(UsersModel.user_id == user_id))
         )
-        if result.scalar_one_or_none():
-            return True
-        else:
-            return False
+        return result.scalar()
 
 
 class UserAddressesModel(BaseModel):
@@ -196,6 +374,27 @@ class OrdersModel(BaseModel):
     """Модель заказов в системе."""
 
     __tablename__ = "orders"
+    __table_args__ = (
+        # История заказов: keyset пагинация по (order_date, order_id) пользователя
+        Index(
+            "idx_orders_user_id_order_date",
+            "user_id",
+            text("order_date DESC"),
+            text("order_id DESC"),
+        ),
+        {"schema": "plotva"},
+    )
+
+    # Поля, которые можно запросить в истории заказов
+    LIST_FIELDS = (
+        "order_id",
+        "user_id",
+        "address_id",
+        "status",
+        "order_date",
+        "shipped_date",
+        "total_cost_rub",
+    )
 
     order_id: Mapped[UUID] = mapped_column(
         primary_key=True, default=uuid4, server_default=text("gen_random_uuid()")
@@ -214,24 +413,80 @@ class OrdersModel(BaseModel):
     )
 
     @classmethod
-    async def get_user_orders(cls, session: AsyncSession, user_id: UUID):
+    async def get_user_orders(
+        cls,
+        session: AsyncSession,
+        user_id: UUID,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None,
+        summary: bool = False,
+    ) -> Tuple[List[dict], Optional[str]]:
         """
-        Получает все заказы пользователя.
+        Получает страницу заказов пользователя от новых к старым.
+
+        Страницы выбираются по ключу (order_date, order_id) из индекса
+        idx_orders_user_id_order_date, без OFFSET, поэтому глубокие страницы
+        не медленнее первой.
 
         Args:
             session: Асинхронная сессия SQLAlchemy
             user_id: UUID пользователя
+            limit: Размер страницы
+            cursor: Курсор из предыдущей страницы (None - первая страница)
+            fields: Возвращаемые поля из LIST_FIELDS (None - все)
+            summary: Добавить entries_count и items_count, посчитанные в SQL
 
         Returns:
-            Список заказов в формате словарей
+            Список заказов в формате словарей и курсор следующей страницы
+            (None, если страница последняя)
+
+        Raises:
+            ValueError: При неизвестных полях или некорректном курсоре
         """
-        orders = await session.execute(
-            select(OrdersModel)
-            .where(OrdersModel.user_id == user_id)
-            .order_by(OrdersModel.order_date.desc())
-        )
-        orders_list = [order.to_dict() for order in orders.scalars().all()]
-        return orders_list
+        fields = list(fields or cls.LIST_FIELDS)
+        unknown = [field for field in fields if field not in cls.LIST_FIELDS]
+        if unknown:
+            raise ValueError(f"Неизвестные поля: {unknown}")
+
+        # Ключ пагинации нужен для курсора, даже если его не запросили
+        key_columns = [OrdersModel.order_date, OrdersModel.order_id]
+        columns = [getattr(OrdersModel, field) for field in fields]
+        columns += [column for column in key_columns if column.key not in fields]
+        if summary:
+            entries = (
+                select(
+                    func.count().label("entries_count"),
+                    func.coalesce(func.sum(OrderEntriesModel.quantity), 0).label(
+                        "items_count"
+                    ),
+                )
+                .where(OrderEntriesModel.order_id == OrdersModel.order_id)
+                .lateral("entries")
+            )
+            columns += [entries.c.entries_count, entries.c.items_count]
+
+        query = select(*columns).where(OrdersModel.user_id == user_id)
+        if summary:
+            query = query.join(entries, text("TRUE"))
+        if cursor is not None:
+            query = query.where(
+                tuple_(OrdersModel.order_date, OrdersModel.order_id)
+                < tuple_(*decode_order_cursor(cursor))
+            )
+        query = query.order_by(
+            OrdersModel.order_date.desc(), OrdersModel.order_id.desc()
+        ).limit(limit + 1)
+
+        rows = (await session.execute(query)).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_order_cursor(rows[-1].order_date, rows[-1].order_id)
+
+        output = fields + (["entries_count", "items_count"] if summary else [])
+        orders_list = [{name: row._mapping[name] for name in output} for row in rows]
+        return orders_list, next_cursor
 
     @classmethod
     async def get_order(cls, session: AsyncSession, order_id: str):
@@ -255,17 +510,127 @@ class OrdersModel(BaseModel):
 
     async def update_status(self, session: AsyncSession, status: str):
         """
-        Обновляет статус заказа с проверкой допустимых переходов.
+        Обновляет статус загруженного заказа с проверкой допустимых переходов.
 
         Args:
             session: Асинхронная сессия SQLAlchemy
             status: Новый статус заказа
-        """
 
+        Raises:
+            InvalidStatusTransitionError: Если переход не разрешен
+        """
+        current = OrderStatus(self.status)
         new_status = OrderStatus(status)
+        if not can_transition(current, new_status):
+            raise InvalidStatusTransitionError(current, new_status)
 
         self.status = new_status.value
 
+    @classmethod
+    async def transition_status(
+        cls, session: AsyncSession, order_id: UUID, status: OrderStatus
+    ) -> Optional[OrderStatus]:
+        """
+        Переводит заказ в новый статус одним условным UPDATE: строка меняется,
+        только если текущий статус допускает переход (см. ORDER_STATUS_TRANSITIONS).
+        Позиции заказа не загружаются, а проверка и запись атомарны, поэтому
+        параллельные переходы одного заказа не перезаписывают друг друга.
+
+        Args:
+            session: Асинхронная сессия SQLAlchemy
+            order_id: UUID заказа
+            status: Новый статус заказа
+
+        Returns:
+            Новый статус или None, если заказ не найден
+
+        Raises:
+            InvalidStatusTransitionError: Если переход из текущего статуса не разрешен
+        """
+        new_status = OrderStatus(status)
+        allowed = bindparam(
+            "allowed", statuses_allowed_before(new_status), type_=ARRAY(String)
+        )
+        result = await session.execute(
+            update(OrdersModel)
+            .where(
+                OrdersModel.order_id == order_id,
+                OrdersModel.status == any_(allowed),
+            )
+            .values(status=new_status.value)
+            .returning(OrdersModel.status)
+        )
+        if result.scalar_one_or_none() is not None:
+            return new_status
+
+        # Второй запрос нужен только чтобы объяснить отказ
+        current = await session.scalar(
+            select(OrdersModel.status).where(OrdersModel.order_id == order_id)
+        )
+        if current is None:
+            return None
+        raise InvalidStatusTransitionError(OrderStatus(current), new_status)
+
+    @classmethod
+    async def transition_statuses(
+        cls, session: AsyncSession, updates: Sequence[Tuple[UUID, OrderStatus]]
+    ) -> List[dict]:
+        """
+        Применяет пачку переходов статусов одним запросом (см. _BULK_STATUS_SQL)
+        по тем же правилам, что и transition_status. Отклоненные переходы
+        не мешают остальным.
+
+        Args:
+            session: Асинхронная сессия SQLAlchemy
+            updates: Пары (UUID заказа, новый статус), заказы не повторяются
+
+        Returns:
+            Результаты в порядке updates: словари с order_id, updated,
+            status (статус после запроса, None - заказ не найден) и error_message
+
+        Raises:
+            ValueError: Если заказ встречается в пачке несколько раз
+        """
+        order_ids = [order_id for order_id, _ in updates]
+        if len(set(order_ids)) != len(order_ids):
+            raise ValueError("Заказ указан в пачке несколько раз")
+        if not updates:
+            return []
+
+        pairs = transition_pairs()
+        result = await session.execute(
+            _BULK_STATUS_SQL,
+            {
+                "order_ids": order_ids,
+                "statuses": [OrderStatus(status).value for _, status in updates],
+                "from_statuses": [current for current, _ in pairs],
+                "to_statuses": [new for _, new in pairs],
+            },
+        )
+
+        results = []
+        for row in result:
+            if row.updated:
+                status, error_message = row.new_status, None
+            elif row.current_status is None:
+                status, error_message = None, f"Заказ с ID {row.order_id} не найден"
+            else:
+                status = row.current_status
+                error_message = str(
+                    InvalidStatusTransitionError(
+                        OrderStatus(row.current_status), OrderStatus(row.new_status)
+                    )
+                )
+            results.append(
+                {
+                    "order_id": row.order_id,
+                    "updated": row.updated,
+                    "status": status,
+                    "error_message": error_message,
+                }
+            )
+        return results
+
     @classmethod
     async def delete_order(cls, session: AsyncSession, order_id: UUID):
         """
@@ -295,7 +660,9 @@ class OrdersModel(BaseModel):
         session: AsyncSession,
     ):
         """
-        Создает новый заказ с указанными товарами.
+        Создает новый заказ с указанными товарами за один запрос к базе
+        (см. _CREATE_ORDER_SQL). amounts[i] относится к product_id_list[i],
+        повторяющиеся товары становятся отдельными позициями.
 
         Args:
             user_id: UUID пользователя
@@ -307,65 +674,50 @@ class OrdersModel(BaseModel):
             session: Асинхронная сессия SQLAlchemy
 
         Returns:
-            Созданный объект OrdersModel
+            Созданный объект OrdersModel (не привязан к сессии)
 
         Raises:
+            UserNotFoundError: Если пользователь не найден
             ValueError: При несоответствии количества товаров и количеств
                        Если товары не найдены
         """
         if len(product_id_list) != len(amounts):
             raise ValueError("Количество товаров и количеств не совпадает")
-
-        products = await session.execute(
-            select(ProductsModel)
-            .options(selectinload(ProductsModel.seller))
-            .where(ProductsModel.product_id.in_(product_id_list))
-            .order_by(ProductsModel.product_id)
-        )
-        products = products.scalars().all()
-
-        if len(products) != len(product_id_list):
-            found_ids = {str(p.product_id) for p in products}
-            missing_ids = [
-                str(pid) for pid in product_id_list if str(pid) not in found_ids
-            ]
-            raise ValueError(f"Товары не найдены: {missing_ids}")
-
-        total_cost = 0
-        order_entries = []
-
-        for i, product in enumerate(products):
-            amount = amounts[i]
-            total_cost += product.price_rub * amount
-
-            order_entries.append(
-                OrderEntriesModel(
-                    product_id=product.product_id,
-                    quantity=amount,
-                    product_name=product.name,
-                    product_price_rub=product.price_rub,
-                    product_seller_id=product.seller_id,
-                    product_seller_name=product.seller.name,
-                )
-            )
+        if not product_id_list:
+            raise ValueError("Заказ не содержит товаров")
+        if any(amount <= 0 for amount in amounts):
+            raise ValueError("Количество товара должно быть положительным")
 
         order = OrdersModel(
+            order_id=uuid4(),
             user_id=user_id,
-            address_id=address_id,
+            address_id=UUID(str(address_id)),
             status=OrderStatus.PENDING.value,
             order_date=order_time,
             shipped_date=shipped_time,
-            total_cost_rub=total_cost,
         )
+        result = await session.execute(
+            _CREATE_ORDER_SQL,
+            {
+                "product_ids": [UUID(str(pid)) for pid in product_id_list],
+                "amounts": list(amounts),
+                "user_id": order.user_id,
+                "order_id": order.order_id,
+                "address_id": order.address_id,
+                "status": order.status,
+                "order_date": order.order_date,
+                "shipped_date": order.shipped_date,
+            },
+        )
+        row = result.one()
 
-        session.add(order)
-        await session.flush()
-
-        for entry in order_entries:
-            entry.order_id = order.order_id
-            session.add(entry)
+        if not row.user_exists:
+            raise UserNotFoundError("Пользователь не найден")
+        if row.missing_product_ids:
+            missing_ids = [str(pid) for pid in row.missing_product_ids]
+            raise ValueError(f"Товары не найдены: {missing_ids}")
 
-        order.status = OrderStatus.SHIPPED.value
+        order.total_cost_rub = row.total_cost_rub
         return order
 
     @classmethod
@@ -385,6 +737,7 @@ class OrdersModel(BaseModel):
 
         Raises:
             ValueError: Если заказ не найден
+            InvalidStatusTransitionError: Если переход статуса не разрешен
         """
         order = await cls.get_order(session, order_id)
 
@@ -401,7 +754,7 @@ class OrdersModel(BaseModel):
             updated_fields.append("shipped_date")
 
         if "status" in update_data:
-            await order.update_status(session, update_data["status"])
+            await cls.transition_status(session, order_id, update_data["status"])
             updated_fields.append("status")
 
         if "entries" in update_data:
@@ -420,6 +773,10 @@ class OrderEntriesModel(BaseModel):
     """Модель позиций заказа. Каждая запись представляет один товар в заказе"""
 
     __tablename__ = "order_entries"
+    __table_args__ = (
+        Index("idx_order_entries_order_id", "order_id"),
+        {"schema": "plotva"},
+    )
 
     entry_id: Mapped[int] = mapped_column(primary_key=True, index=True)
     order_id: Mapped[UUID] = mapped_column(ForeignKey("plotva.orders.order_id"))
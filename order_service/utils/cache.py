@@ -0,0 +1,151 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Protocol, Tuple
+
+
+class SharedCache(Protocol):
+    """
+    Общий для всех инстансов кэш (например, redis.asyncio.Redis).
+    Ключи и значения - байты, ex - TTL в секундах.
+    """
+
+    async def get(self, key: str) -> Optional[bytes]: ...
+
+    async def set(self, key: str, value: bytes, ex: Optional[int] = None) -> Any: ...
+
+    async def delete(self, *keys: str) -> Any: ...
+
+
+class LocalCache:
+    """
+    LRU кэш в памяти процесса с TTL и ограничением по числу записей и байтам.
+    Реализует интерфейс SharedCache, поэтому может заменять общий кэш локально.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ex: Optional[int] = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        self._pop(key)
+        expires_at = time.monotonic() + ex if ex is not None else float("inf")
+        self._entries[key] = (value, expires_at)
+        self.size_bytes += len(value)
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._pop(key)
+
+    def _pop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= len(entry[0])
+
+
+class OrderDetailsCache:
+    """
+    Read-through кэш сериализованных ответов get_order_details по order_id.
+
+    Сначала проверяется локальный LocalCache, затем shared (если задан).
+    Записи живут ttl секунд. Изменение заказа через API сразу сбрасывает
+    локальную запись этого инстанса и запись в shared; локальные копии
+    других инстансов остаются до истечения ttl, поэтому ttl - это верхняя
+    граница устаревания ответа.
+    Ответ, загруженный параллельно со сбросом, в кэш не кладется, чтобы
+    не вернуть туда состояние до изменения.
+    """
+
+    def __init__(
+        self,
+        ttl: int = 30,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        shared: Optional[SharedCache] = None,
+        prefix: str = "order_details:",
+    ):
+        self.ttl = ttl
+        self.local = LocalCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.shared = shared
+        self.prefix = prefix
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _key(self, order_id: Any) -> str:
+        return f"{self.prefix}{order_id}"
+
+    async def get(self, order_id: Any) -> Optional[bytes]:
+        key = self._key(order_id)
+        value = await self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.shared is not None:
+            value = await self.shared.get(key)
+            if value is not None:
+                self.shared_hits += 1
+                await self.local.set(key, value, ex=self.ttl)
+                return value
+        self.misses += 1
+        return None
+
+    async def get_or_load(
+        self, order_id: Any, loader: Callable[[], Awaitable[Optional[bytes]]]
+    ) -> Tuple[Optional[bytes], bool]:
+        """
+        Возвращает (данные, взяты_из_кэша). None от loader не кэшируется.
+        """
+        value = await self.get(order_id)
+        if value is not None:
+            return value, True
+        invalidations = self.invalidations
+        value = await loader()
+        if value is not None and invalidations == self.invalidations:
+            key = self._key(order_id)
+            await self.local.set(key, value, ex=self.ttl)
+            if self.shared is not None:
+                await self.shared.set(key, value, ex=self.ttl)
+        return value, False
+
+    async def invalidate(self, order_id: Any) -> None:
+        self.invalidations += 1
+        key = self._key(order_id)
+        await self.local.delete(key)
+        if self.shared is not None:
+            await self.shared.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.shared_hits) / requests if requests else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.local.evictions,
+            "entries": len(self.local),
+            "size_bytes": self.local.size_bytes,
+        }
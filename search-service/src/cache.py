@@ -0,0 +1,202 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+# Параметры полнотекстового поиска (match): анализатор ES не различает регистр
+# и лишние пробелы. Остальные, например seller_id (term по keyword), сравниваются
+# как есть
+FULL_TEXT_PARAMS = frozenset({"name", "category", "content"})
+
+
+def normalize_value(key: str, value: Any) -> Any:
+    if key in FULL_TEXT_PARAMS and isinstance(value, str):
+        return " ".join(value.lower().split())
+    return value
+
+
+def make_key(
+    index: str, params: Dict[str, Any] | None = None, page: Hashable = None
+) -> Tuple[Hashable, ...]:
+    """
+    Ключ кэша: индекс, параметры запроса без учета порядка (полнотекстовые
+    нормализуются) и страница (лимит, курсор), которая сравнивается как есть
+    """
+    items = tuple(
+        sorted(
+            (key, normalize_value(key, value))
+            for key, value in (params or {}).items()
+            if value is not None
+        )
+    )
+    return (index, items, page)
+
+
+class SearchCache:
+    """
+    In-process LRU кэш результатов поиска с TTL.
+
+    При single_flight=True одновременные промахи по одному ключу ждут
+    один запрос к Elasticsearch вместо того, чтобы отправлять свои.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 30.0, single_flight: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.single_flight = single_flight
+
+        self._entries: OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]] = OrderedDict()
+        self._in_flight: Dict[Tuple[Hashable, ...], asyncio.Future] = {}
+        self._generations: Dict[str, int] = {}
+        self._global_generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple[Hashable, ...]) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def put(self, key: Tuple[Hashable, ...], value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup(
+        self, index: str, params: Dict[str, Any] | None, page: Hashable = None
+    ) -> Tuple[bool, Any]:
+        """Поиск без загрузки, для пакетных запросов; учитывается в счетчиках"""
+        if self.max_entries <= 0:
+            self.misses += 1
+            return False, None
+        found, value = self.get(make_key(index, params, page))
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found, value
+
+    def store(
+        self,
+        index: str,
+        params: Dict[str, Any] | None,
+        page: Hashable,
+        value: Any,
+        generation: Tuple[int, int],
+    ) -> None:
+        """Сохраняет результат, если индекс не инвалидировали после generation"""
+        if self.max_entries > 0 and self.generation(index) == generation:
+            self.put(make_key(index, params, page), value)
+
+    async def get_or_load(
+        self,
+        index: str,
+        params: Dict[str, Any] | None,
+        loader: Callable[[], Awaitable[Any]],
+        page: Hashable = None,
+    ) -> Any:
+        if self.max_entries <= 0:
+            return await loader()
+
+        key = make_key(index, params, page)
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+        self.misses += 1
+
+        leader = self._in_flight.get(key) if self.single_flight else None
+        if leader is not None:
+            try:
+                return await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                # Отменили сам запрос-лидер, а не ожидающего: загружаем сами
+                if not leader.cancelled():
+                    raise
+            return await loader()
+
+        generation = self.generation(index)
+        future: Optional[asyncio.Future] = None
+        if self.single_flight:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            if future is not None:
+                future.cancel()
+            raise
+        except Exception as e:
+            if future is not None:
+                future.set_exception(e)
+                # Исключение уже передано ожидающим, здесь оно не нужно
+                future.exception()
+            raise
+        else:
+            # Если индекс инвалидировали во время запроса, результат может быть устаревшим
+            if self.generation(index) == generation:
+                self.put(key, value)
+            if future is not None:
+                future.set_result(value)
+            return value
+        finally:
+            if future is not None:
+                self._in_flight.pop(key, None)
+
+    def generation(self, index: str) -> Tuple[int, int]:
+        return self._global_generation, self._generations.get(index, 0)
+
+    def invalidate(self, index: Optional[str] = None) -> int:
+        """Удаляет записи индекса (или все записи) и возвращает их количество"""
+        if index is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._global_generation += 1
+        else:
+            keys = [key for key in self._entries if key[0] == index]
+            for key in keys:
+                del self._entries[key]
+            removed = len(keys)
+            self._generations[index] = self._generations.get(index, 0) + 1
+        self.invalidations += 1
+        return removed
+
+    def invalidate_ids(self, index: str, ids: Iterable[str]) -> int:
+        """
+        Удаляет записи индекса, в результатах (ids, курсор) которых есть хотя бы
+        один из ids, и возвращает их количество. Подходит для удаленных
+        документов: в результаты, где их не было, они попасть уже не могут.
+        """
+        ids = set(ids)
+        keys = [
+            key
+            for key, (_, value) in self._entries.items()
+            if key[0] == index and value[0] and not ids.isdisjoint(value[0])
+        ]
+        for key in keys:
+            del self._entries[key]
+        # Запрос, начатый до удаления, мог вернуть удаленные документы
+        self._generations[index] = self._generations.get(index, 0) + 1
+        self.invalidations += 1
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+            "size": len(self._entries),
+            "invalidations": self.invalidations,
+        }
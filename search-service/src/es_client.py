@@ -0,0 +1,67 @@
+import os
+
+import aiohttp
+
+from logger import logger
+
+from typing import Optional
+
+
+ES_POOL_SIZE = int(os.getenv("ES_POOL_SIZE", "100"))
+ES_POOL_SIZE_PER_HOST = int(os.getenv("ES_POOL_SIZE_PER_HOST", "50"))
+ES_KEEPALIVE_TIMEOUT = float(os.getenv("ES_KEEPALIVE_TIMEOUT", "30"))
+ES_CONNECT_TIMEOUT = float(os.getenv("ES_CONNECT_TIMEOUT", "2"))
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "10"))
+
+
+class ElasticClient:
+    """
+    Долгоживущая сессия aiohttp для Elasticsearch с ограниченным пулом
+    keep-alive соединений. Создается один раз на процесс: start() при запуске,
+    close() при остановке.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        pool_size: int = ES_POOL_SIZE,
+        pool_size_per_host: int = ES_POOL_SIZE_PER_HOST,
+        keepalive_timeout: float = ES_KEEPALIVE_TIMEOUT,
+        connect_timeout: float = ES_CONNECT_TIMEOUT,
+        request_timeout: float = ES_REQUEST_TIMEOUT,
+    ):
+        self.endpoint = endpoint.rstrip("/")
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            total=request_timeout, connect=connect_timeout
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_size_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(
+            base_url=self.endpoint, connector=connector, timeout=self.timeout
+        )
+        logger.info(f"Elasticsearch client for {self.endpoint} started")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("Elasticsearch client is not started")
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is None or self._session.closed:
+            return
+        await self._session.close()
+        self._session = None
+        logger.info(f"Elasticsearch client for {self.endpoint} closed")
@@ -1,76 +1,200 @@
+import hmac
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi import Header
+from fastapi import Query
 from fastapi import Response
 from fastapi.responses import JSONResponse
 from fastapi import status
 
-from service import process
+from pydantic import BaseModel, Field
+
+from service import (
+    DEFAULT_LIMIT,
+    MAX_LIMIT,
+    MAX_MSEARCH_QUERIES,
+    es_client,
+    multi_process,
+    process,
+    search_cache,
+)
 
 from logger import logger
 
 from aiohttp import ClientError
 
-app = FastAPI()
+from typing import Any, Dict, List, Optional
 
-@app.get("/products")
-async def search_products_by_name(name: str = None):
+# Общий секрет с elastic-update-service; без него сброс кэша по HTTP выключен
+CACHE_INVALIDATE_TOKEN = os.getenv("CACHE_INVALIDATE_TOKEN")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not CACHE_INVALIDATE_TOKEN:
+        logger.warning(
+            "CACHE_INVALIDATE_TOKEN is not set, /cache/invalidate is disabled"
+        )
+    await es_client.start()
+    yield
+    await es_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+async def search_response(
+    index: str, param: Dict[str, Any] | None, limit: int, cursor: str | None
+) -> Response:
+    """
+    Ищет в индексе и отдает список id. Курсор следующей страницы
+    передается в заголовке X-Next-Cursor.
+    """
     try:
-        if name:
-            response_body = await process("products", {"name": name})
-        else:
-            response_body = await process("products")
-        if response_body:
-            logger.info("Search in index products done")
-            return JSONResponse(response_body, status.HTTP_200_OK)
+        ids, next_cursor = await process(index, param, limit, cursor)
+        if ids:
+            logger.info(f"Search in index {index} done")
+            headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+            return JSONResponse(ids, status.HTTP_200_OK, headers=headers)
         else:
             return Response(status_code=status.HTTP_404_NOT_FOUND)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
     except ClientError as e:
-        logger.error("Search in index products done with error")
+        logger.error(f"Search in index {index} done with error")
         return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def product_params(
+    name: str | None,
+    category: str | None,
+    min_price: int | None,
+    max_price: int | None,
+    seller_id: str | None,
+) -> Dict[str, Any] | None:
+    if min_price is not None and max_price is not None and min_price > max_price:
+        raise ValueError("min_price is greater than max_price")
+    param = {
+        "name": name,
+        "category": category,
+        "min_price": min_price,
+        "max_price": max_price,
+        "seller_id": seller_id,
+    }
+    return {key: value for key, value in param.items() if value is not None} or None
+
+
+class ProductSearch(BaseModel):
+    name: Optional[str] = None
+    category: Optional[str] = None
+    min_price: Optional[int] = Field(None, ge=0)
+    max_price: Optional[int] = Field(None, ge=0)
+    seller_id: Optional[str] = None
+    limit: int = Field(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT)
+    cursor: Optional[str] = None
+
+
 @app.get("/products")
-async def search_products_by_category(category: str = None):
+async def search_products(
+    name: str = None,
+    category: str = None,
+    min_price: int = Query(None, ge=0),
+    max_price: int = Query(None, ge=0),
+    seller_id: str = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: str = None,
+):
     try:
-        if category:
-            response_body = await process("products", {"category": category})
-        else:
-            response_body = await process("products")
-        if response_body:
-            logger.info("Search in index products done")
-            return JSONResponse(response_body, status.HTTP_200_OK)
-        else:
-            return Response(status_code=status.HTTP_404_NOT_FOUND)
-    except ClientError as e:
-        logger.error("Search in index products done with error")
-        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        param = product_params(name, category, min_price, max_price, seller_id)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+    return await search_response("products", param, limit, cursor)
 
-@app.get("/sellers")
-async def search_sellers(name: str = None):
+@app.post("/products/_msearch")
+async def multi_search_products(searches: List[ProductSearch]):
+    """
+    Несколько поисков по товарам за один HTTP вызов и один запрос к ES.
+    Для каждого поиска возвращаются id и курсор следующей страницы.
+    """
+    if not searches or len(searches) > MAX_MSEARCH_QUERIES:
+        return JSONResponse(
+            {"error": f"from 1 to {MAX_MSEARCH_QUERIES} searches are allowed"},
+            status.HTTP_400_BAD_REQUEST,
+        )
     try:
-        if name:
-            response_body = await process("sellers", {"name": name})
-        else:
-            response_body = await process("sellers")
-        if response_body:
-            logger.info("Search in index sellers done")
-            return JSONResponse(response_body, status.HTTP_200_OK)
-        else:
-            return Response(status_code=status.HTTP_404_NOT_FOUND)
+        batch = [
+            (
+                product_params(
+                    item.name, item.category, item.min_price, item.max_price, item.seller_id
+                ),
+                item.limit,
+                item.cursor,
+            )
+            for item in searches
+        ]
+        pages = await multi_process("products", batch)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
     except ClientError as e:
-        logger.error("Search in index sellers done with error")
+        logger.error("Multi search in index products done with error")
         return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    logger.info(f"Multi search in index products done: {len(searches)} searches")
+    return JSONResponse(
+        [{"ids": ids or [], "next_cursor": next_cursor} for ids, next_cursor in pages],
+        status.HTTP_200_OK,
+    )
+
+@app.get("/sellers")
+async def search_sellers(
+    name: str = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: str = None,
+):
+    return await search_response("sellers", {"name": name} if name else None, limit, cursor)
 
 @app.get("/comments")
-async def search_comments(content: str = None):
-    try:
-        if content:
-            response_body = await process("comments", {"content": content})
-        else:
-            response_body = await process("comments")
-        if response_body:
-            logger.info("Search in index comments done")
-            return JSONResponse(response_body, status.HTTP_200_OK)
-        else:
-            return Response(status_code=status.HTTP_404_NOT_FOUND)
-    except ClientError as e:
-        logger.error("Search in index comments done with error")
-        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+async def search_comments(
+    content: str = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: str = None,
+):
+    return await search_response(
+        "comments", {"content": content} if content else None, limit, cursor
+    )
+
+class CacheInvalidation(BaseModel):
+    deleted_ids: List[str] = Field(default_factory=list)
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(
+    index: str = None,
+    body: Optional[CacheInvalidation] = None,
+    x_cache_invalidate_token: str = Header(None),
+):
+    """
+    Сбрасывает кэш индекса (или весь кэш). Если переданы deleted_ids,
+    сбрасываются только результаты с этими документами.
+    Требует заголовок X-Cache-Invalidate-Token.
+    """
+    if not CACHE_INVALIDATE_TOKEN or not hmac.compare_digest(
+        (x_cache_invalidate_token or "").encode("utf-8"),
+        CACHE_INVALIDATE_TOKEN.encode("utf-8"),
+    ):
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+    if body is not None and body.deleted_ids:
+        if index is None:
+            return JSONResponse(
+                {"error": "deleted_ids require index"}, status.HTTP_400_BAD_REQUEST
+            )
+        removed = search_cache.invalidate_ids(index, body.deleted_ids)
+    else:
+        removed = search_cache.invalidate(index)
+    logger.info(f"Search cache invalidated for index {index or 'all'}: {removed} entries removed")
+    return JSONResponse({"removed": removed}, status.HTTP_200_OK)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return JSONResponse(search_cache.stats(), status.HTTP_200_OK)
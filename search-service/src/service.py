@@ -1,13 +1,60 @@
+import asyncio
+import base64
+import json
+import os
+
 import aiohttp
 
-from typing import List, Dict, Any
+from cache import SearchCache, make_key
+
+from es_client import ElasticClient
+
+from typing import List, Dict, Any, Hashable, Tuple
 
 
 ES_URL = "http://elasticsearch:9200"
 
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "10000"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30"))
+SEARCH_CACHE_SINGLE_FLIGHT = os.getenv("SEARCH_CACHE_SINGLE_FLIGHT", "1") == "1"
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_MSEARCH_QUERIES = 20
+
+# Сортировка по релевантности с id как tiebreak, чтобы search_after был стабильным
+SORT = [{"_score": "desc"}, {"id": "asc"}]
+
+es_client = ElasticClient(ES_URL)
+
+search_cache = SearchCache(
+    max_entries=SEARCH_CACHE_SIZE,
+    ttl=SEARCH_CACHE_TTL,
+    single_flight=SEARCH_CACHE_SINGLE_FLIGHT,
+)
+
+SearchPage = Tuple[List[str] | None, str | None]
+
+
+def encode_cursor(sort_values: List[Any]) -> str:
+    raw = json.dumps(sort_values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(sort_values, list) or len(sort_values) != len(SORT):
+        raise ValueError("invalid cursor")
+    return sort_values
+
+
 async def search(url: str, body: Dict[str, str] | None = None):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, json=body) as response:
+    try:
+        async with es_client.session.get(url, json=body) as response:
             if response.status != 200:
                 if response.status != 404:
                     raise aiohttp.ClientError()
@@ -15,29 +62,157 @@ async def search(url: str, body: Dict[str, str] | None = None):
                     return None
             else:
                 return await response.json()
-            
+    except asyncio.TimeoutError as e:
+        raise aiohttp.ClientError("elasticsearch request timed out") from e
+
+
+def build_product_query(param: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Один bool запрос по товарам: название влияет на релевантность,
+    остальные условия идут в filter, чтобы ES мог их кэшировать
+    """
+    must = []
+    filters = []
+    if param.get("name"):
+        must.append({"match": {"name": param["name"]}})
+    if param.get("category"):
+        filters.append(
+            {"match": {"category": {"query": param["category"], "operator": "and"}}}
+        )
+    price_range = {}
+    if param.get("min_price") is not None:
+        price_range["gte"] = param["min_price"]
+    if param.get("max_price") is not None:
+        price_range["lte"] = param["max_price"]
+    if price_range:
+        filters.append({"range": {"price_rub": price_range}})
+    if param.get("seller_id"):
+        filters.append({"term": {"seller_id": param["seller_id"]}})
+    return {"bool": {"must": must or [{"match_all": {}}], "filter": filters}}
 
-async def process(index: str, param: Dict[str, str] | None = None) -> List[str] | None:
-    url = ES_URL + f"/{index}/_search"
-    
+
+def build_query(
+    index: str,
+    param: Dict[str, Any] | None = None,
+    limit: int = DEFAULT_LIMIT,
+    search_after: List[Any] | None = None,
+) -> Dict[str, Any]:
+    query = {
+        "size": limit,
+        "_source": False,
+        "track_total_hits": False,
+        "sort": SORT,
+    }
     if param:
-        query = {
-            "query": {
-                "match": {}
-            }
-        }
-        for key, value in param.items():
-            query["query"]["match"][key] = value
-        response = await search(url, query)
-    else:
-        response = await search(url)
+        if index == "products":
+            query["query"] = build_product_query(param)
+        else:
+            query["query"] = {"match": {}}
+            for key, value in param.items():
+                query["query"]["match"][key] = value
+    if search_after:
+        query["search_after"] = search_after
+    return query
+
+
+def parse_hits(response: Dict[str, Any] | None, limit: int) -> SearchPage:
     if not response:
-        return None
+        return None, None
     hits = response['hits']['hits']
     if hits:
         res = []
         for doc in hits:
             res.append(doc["_id"])
-        return res
-    return None
-    
\ No newline at end of file
+        next_cursor = encode_cursor(hits[-1]["sort"]) if len(hits) == limit else None
+        return res, next_cursor
+    return None, None
+
+
+async def process(
+    index: str,
+    param: Dict[str, Any] | None = None,
+    limit: int = DEFAULT_LIMIT,
+    cursor: str | None = None,
+) -> SearchPage:
+    """
+    Возвращает id найденных документов и курсор следующей страницы.
+
+    Raises:
+        ValueError: если курсор поврежден
+    """
+    search_after = decode_cursor(cursor) if cursor else None
+    return await search_cache.get_or_load(
+        index,
+        param,
+        lambda: search_index(index, param, limit, search_after),
+        page=(limit, cursor),
+    )
+
+
+async def search_index(
+    index: str,
+    param: Dict[str, Any] | None = None,
+    limit: int = DEFAULT_LIMIT,
+    search_after: List[Any] | None = None,
+) -> SearchPage:
+    response = await search(f"/{index}/_search", build_query(index, param, limit, search_after))
+    return parse_hits(response, limit)
+
+
+async def multi_process(
+    index: str,
+    searches: List[Tuple[Dict[str, Any] | None, int, str | None]],
+) -> List[SearchPage]:
+    """
+    Выполняет несколько поисков одним запросом в _msearch.
+    Результаты из кэша в запрос не попадают.
+
+    Raises:
+        ValueError: если один из курсоров поврежден
+    """
+    results: List[SearchPage | None] = [None] * len(searches)
+    lines = []
+    pending: Dict[Tuple[Hashable, ...], List[int]] = {}
+    generation = search_cache.generation(index)
+    for position, (param, limit, cursor) in enumerate(searches):
+        search_after = decode_cursor(cursor) if cursor else None
+        key = make_key(index, param, (limit, cursor))
+        if key in pending:
+            pending[key].append(position)
+            continue
+        found, value = search_cache.lookup(index, param, (limit, cursor))
+        if found:
+            results[position] = value
+            continue
+        lines.append(json.dumps({"index": index}))
+        lines.append(json.dumps(build_query(index, param, limit, search_after)))
+        pending[key] = [position]
+
+    if not pending:
+        return results
+
+    payload = ("\n".join(lines) + "\n").encode("utf-8")
+    try:
+        async with es_client.session.post(
+            "/_msearch",
+            data=payload,
+            headers={"Content-Type": "application/x-ndjson"},
+        ) as response:
+            if response.status != 200:
+                raise aiohttp.ClientError()
+            body = await response.json()
+    except asyncio.TimeoutError as e:
+        raise aiohttp.ClientError("elasticsearch request timed out") from e
+
+    for positions, item in zip(pending.values(), body["responses"]):
+        param, limit, cursor = searches[positions[0]]
+        if "error" in item:
+            if item.get("status") != 404:
+                raise aiohttp.ClientError(str(item["error"]))
+            page = (None, None)
+        else:
+            page = parse_hits(item, limit)
+        search_cache.store(index, param, (limit, cursor), page, generation)
+        for position in positions:
+            results[position] = page
+    return results
@@ -1,7 +1,20 @@
 from abc import ABCMeta, abstractmethod
+from array import array
+from bisect import bisect_left
 from datetime import datetime
 from pathlib import PurePath
-from typing import IO, Any, Dict, Iterable
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableSequence,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 from attr import attrib, dataclass
 
@@ -11,10 +24,26 @@ __all__ = [
     "IFileStorageAdapterProvider",
     "Diff",
     "get_diff",
+    "Change",
+    "SortedSnapshot",
+    "iter_changes",
     "UniversalNamePath",
     "IFile",
 ]
 
+NEW = "new"
+DELETED = "deleted"
+MODIFIED = "modified"
+NOT_MODIFIED = "not_modified"
+
+
+class Change(NamedTuple):
+    """Изменение одного ключа; kind совпадает с именем поля Diff"""
+
+    kind: str
+    key: str
+    value: Any
+
 
 @dataclass
 class Diff:
@@ -26,6 +55,117 @@ class Diff:
     def get_files(self) -> Dict[str, int]:
         return dict(self.not_modified, **self.modified, **self.new)
 
+    @classmethod
+    def from_changes(cls, changes: Iterable[Change]) -> "Diff":
+        diff = cls()
+        for kind, key, value in changes:
+            getattr(diff, kind)[key] = value
+        return diff
+
+
+class SortedSnapshot:
+    """
+    Компактный снимок key -> value: отсортированный список ключей и
+    параллельный массив значений (array("q") для целых, например времени
+    модификации). Без хэш-таблицы он занимает в несколько раз меньше памяти,
+    чем dict, а два снимка сравниваются одним проходом (iter_changes).
+    """
+
+    __slots__ = ("keys", "values")
+
+    def __init__(self, keys: List[str], values: MutableSequence[Any]):
+        self.keys = keys
+        self.values = values
+
+    @classmethod
+    def from_items(
+        cls, items: Iterable[Tuple[str, Any]], typecode: Optional[str] = "q"
+    ) -> "SortedSnapshot":
+        """
+        Строит снимок из пар (key, value) с уникальными ключами. Уже
+        отсортированный вход (листинг S3, MetadataIndex) не пересортировывается.
+        typecode=None хранит значения в обычном списке (например ETag).
+        """
+        keys: List[str] = []
+        values: MutableSequence[Any] = array(typecode) if typecode else []
+        for key, value in items:
+            keys.append(key)
+            values.append(value)
+        if any(keys[i] > keys[i + 1] for i in range(len(keys) - 1)):
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            keys = [keys[i] for i in order]
+            ordered = array(typecode) if typecode else []
+            ordered.extend(values[i] for i in order)
+            values = ordered
+        return cls(keys, values)
+
+    @classmethod
+    def from_dict(
+        cls, files: Dict[str, Any], typecode: Optional[str] = "q"
+    ) -> "SortedSnapshot":
+        return cls.from_items(sorted(files.items()), typecode)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _find(self, key: str) -> int:
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
+    def __contains__(self, key: str) -> bool:
+        return self._find(key) >= 0
+
+    def __getitem__(self, key: str) -> Any:
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self.values[i]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        i = self._find(key)
+        return self.values[i] if i >= 0 else default
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return zip(self.keys, self.values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(zip(self.keys, self.values))
+
+
+def iter_changes(
+    old: SortedSnapshot, new: SortedSnapshot, include_unchanged: bool = False
+) -> Iterator[Change]:
+    """
+    Merge-join двух снимков: изменения выдаются по одному в порядке ключей,
+    без промежуточных словарей. Значения new/modified/not_modified берутся
+    из нового снимка, deleted - из старого.
+    """
+    old_keys, old_values = old.keys, old.values
+    new_keys, new_values = new.keys, new.values
+    i = j = 0
+    old_len, new_len = len(old_keys), len(new_keys)
+    while i < old_len and j < new_len:
+        old_key, new_key = old_keys[i], new_keys[j]
+        if old_key == new_key:
+            if old_values[i] != new_values[j]:
+                yield Change(MODIFIED, new_key, new_values[j])
+            elif include_unchanged:
+                yield Change(NOT_MODIFIED, new_key, new_values[j])
+            i += 1
+            j += 1
+        elif old_key < new_key:
+            yield Change(DELETED, old_key, old_values[i])
+            i += 1
+        else:
+            yield Change(NEW, new_key, new_values[j])
+            j += 1
+    for k in range(i, old_len):
+        yield Change(DELETED, old_keys[k], old_values[k])
+    for k in range(j, new_len):
+        yield Change(NEW, new_keys[k], new_values[k])
+
 
 @dataclass(slots=True, frozen=True)
 class UniversalNamePath:
@@ -80,24 +220,25 @@ class IFileStorageAdapter(metaclass=ABCMeta):
 
 
 def get_diff(old_files: Dict[str, int], new_files: Dict[str, int]) -> Diff:
-    copy_old_files = old_files.copy()
     diff = Diff()
+    matched = 0
 
     for new_file_iter, new_modified in new_files.items():
-        if new_file_iter in old_files:
-            old_modified = old_files[new_file_iter]
-
-            if new_modified == old_modified:
-                diff.not_modified[new_file_iter] = new_modified
-            else:
-                diff.modified[new_file_iter] = new_modified
-
-            del copy_old_files[new_file_iter]
-        else:
+        old_modified = old_files.get(new_file_iter)
+        if old_modified is None:
             diff.new[new_file_iter] = new_modified
+            continue
+        matched += 1
+        if new_modified == old_modified:
+            diff.not_modified[new_file_iter] = new_modified
+        else:
+            diff.modified[new_file_iter] = new_modified
 
-    for old_file_iter, old_modified in copy_old_files.items():
-        diff.deleted[old_file_iter] = old_modified
+    # Все старые ключи нашлись среди новых - удаленных нет, второй проход не нужен
+    if matched < len(old_files):
+        for old_file_iter, old_modified in old_files.items():
+            if old_file_iter not in new_files:
+                diff.deleted[old_file_iter] = old_modified
 
     return diff
 
@@ -0,0 +1,242 @@
+import fnmatch
+import itertools
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from attr import dataclass
+
+from src.plotva.common.filestorage import Diff
+
+
+__all__ = [
+    "ObjectMeta",
+    "MetadataIndex",
+    "IndexRefresh",
+    "literal_prefix",
+]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    etag TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    modified INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS refreshes (
+    prefix TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+@dataclass(slots=True, frozen=True)
+class ObjectMeta:
+    key: str
+    etag: str
+    size: int
+    modified: int
+
+
+def literal_prefix(pattern: str) -> str:
+    """Часть маски до первого спецсимвола fnmatch"""
+    for i, char in enumerate(pattern):
+        if char in "*?[":
+            return pattern[:i]
+    return pattern
+
+
+def _prefix_range(prefix: str, column: str = "key") -> Tuple[str, Tuple[str, ...]]:
+    """Условие "column начинается с prefix" в виде диапазона ключей"""
+    if not prefix:
+        return "1", ()
+    # Строки сравниваются побайтово в UTF-8, что совпадает с порядком кодовых точек
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return f"{column} >= ? AND {column} < ?", (prefix, upper)
+
+
+class IndexRefresh:
+    """
+    Обновление одного префикса. Листинг добавляется порциями через add во
+    временную таблицу, finish одной транзакцией сравнивает его с индексом,
+    применяет изменения и возвращает Diff.
+    """
+
+    def __init__(self, index: "MetadataIndex", prefix: str, table: str):
+        self._index = index
+        self._prefix = prefix
+        self._table = table
+
+    def add(self, entries: Iterable[ObjectMeta]) -> None:
+        with self._index._lock:
+            self._index._connection.executemany(
+                f"INSERT OR REPLACE INTO temp.{self._table} VALUES (?, ?, ?, ?)",
+                ((e.key, e.etag, e.size, e.modified) for e in entries),
+            )
+
+    def finish(self) -> Diff:
+        index = self._index
+        table = f"temp.{self._table}"
+        where, params = _prefix_range(self._prefix, "o.key")
+        diff = Diff()
+        with index._lock:
+            connection = index._connection
+            connection.execute("BEGIN")
+            try:
+                for key, modified, old_etag, old_modified, etag in connection.execute(
+                    f"""
+                    SELECT l.key, l.modified, o.etag, o.modified, l.etag
+                    FROM {table} l LEFT JOIN objects o ON o.key = l.key
+                    """
+                ):
+                    if old_etag is None:
+                        diff.new[key] = modified
+                    elif old_etag != etag or old_modified != modified:
+                        diff.modified[key] = modified
+                    else:
+                        diff.not_modified[key] = modified
+                for key, modified in connection.execute(
+                    f"""
+                    SELECT o.key, o.modified FROM objects o
+                    WHERE {where}
+                      AND NOT EXISTS (SELECT 1 FROM {table} l WHERE l.key = o.key)
+                    """,
+                    params,
+                ):
+                    diff.deleted[key] = modified
+
+                where, params = _prefix_range(self._prefix)
+                connection.execute(
+                    f"DELETE FROM objects WHERE {where} "
+                    f"AND key NOT IN (SELECT key FROM {table})",
+                    params,
+                )
+                connection.execute(
+                    f"INSERT OR REPLACE INTO objects SELECT * FROM {table}"
+                )
+                connection.execute(
+                    "INSERT OR REPLACE INTO refreshes VALUES (?, ?)",
+                    (self._prefix, time.time()),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            finally:
+                connection.execute(f"DROP TABLE IF EXISTS {table}")
+        return diff
+
+    def cancel(self) -> None:
+        with self._index._lock:
+            self._index._connection.execute(f"DROP TABLE IF EXISTS temp.{self._table}")
+
+
+class MetadataIndex:
+    """
+    Локальный индекс метаданных файлов хранилища (key -> etag, size, modified)
+    в SQLite. Обновляется по префиксам, поэтому для изменений в одной "папке"
+    не нужно листить весь бакет; glob отбирает кандидатов по диапазону ключей
+    с самым длинным литеральным префиксом маски. Один индекс - один бакет.
+    Объект можно использовать из нескольких потоков.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._tables = itertools.count()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def begin_refresh(self, prefix: str = "") -> IndexRefresh:
+        table = f"listing_{next(self._tables)}"
+        with self._lock:
+            self._connection.execute(
+                f"""
+                CREATE TEMP TABLE {table} (
+                    key TEXT PRIMARY KEY,
+                    etag TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    modified INTEGER NOT NULL
+                ) WITHOUT ROWID
+                """
+            )
+        return IndexRefresh(self, prefix, table)
+
+    def refresh_prefix(self, prefix: str, entries: Iterable[ObjectMeta]) -> Diff:
+        """Заменяет содержимое префикса свежим листингом и возвращает изменения"""
+        refresh = self.begin_refresh(prefix)
+        try:
+            refresh.add(entries)
+        except BaseException:
+            refresh.cancel()
+            raise
+        return refresh.finish()
+
+    def last_refresh(self, prefix: str = "") -> Optional[float]:
+        """Время последнего обновления префикса (или охватывающего его префикса)"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT prefix, refreshed_at FROM refreshes WHERE prefix <= ?",
+                (prefix,),
+            ).fetchall()
+        times = [at for known, at in rows if prefix.startswith(known)]
+        return max(times) if times else None
+
+    def get(self, key: str) -> Optional[ObjectMeta]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT key, etag, size, modified FROM objects WHERE key = ?", (key,)
+            ).fetchone()
+        return ObjectMeta(*row) if row else None
+
+    def remove(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM objects WHERE key = ?", ((key,) for key in keys)
+            )
+
+    def iter_prefix(
+        self, prefix: str = "", page_size: int = 1000
+    ) -> Iterator[ObjectMeta]:
+        """Записи префикса в порядке ключей, читаются страницами по page_size"""
+        where, params = _prefix_range(prefix)
+        last = None
+        while True:
+            with self._lock:
+                if last is None:
+                    rows = self._connection.execute(
+                        f"SELECT key, etag, size, modified FROM objects WHERE {where} "
+                        f"ORDER BY key LIMIT ?",
+                        (*params, page_size),
+                    ).fetchall()
+                else:
+                    rows = self._connection.execute(
+                        f"SELECT key, etag, size, modified FROM objects "
+                        f"WHERE {where} AND key > ? ORDER BY key LIMIT ?",
+                        (*params, last, page_size),
+                    ).fetchall()
+            for row in rows:
+                yield ObjectMeta(*row)
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+    def glob(self, pattern: str) -> Iterator[ObjectMeta]:
+        for meta in self.iter_prefix(literal_prefix(pattern)):
+            if fnmatch.fnmatchcase(meta.key, pattern):
+                yield meta
+
+    def keys(self, prefix: str = "") -> List[str]:
+        return [meta.key for meta in self.iter_prefix(prefix)]
@@ -1,27 +1,60 @@
 import asyncio
-from asyncio import AbstractEventLoop
+from concurrent.futures import Executor, ThreadPoolExecutor
 from functools import partial
+import hashlib
+import inspect
 import io
+import itertools
+import json
 import os
+import sqlite3
+import tempfile
+import threading
+import time
 import fnmatch
+from collections import OrderedDict
 from datetime import timezone, datetime
 from logging import getLogger
 from pathlib import PurePath
-from typing import Iterable, Dict, Any, IO, AnyStr, Optional, Iterator, List, Set, Type
+from typing import (
+    Any,
+    AnyStr,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 import urllib3
-from attr import dataclass
+from attr import attrib, dataclass
 import boto3
 from botocore.config import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from src.plotva.common.filestorage import (
+    DELETED,
+    MODIFIED,
+    NEW,
+    Change,
     IFile,
     IFileStorageAdapter,
     Diff,
+    SortedSnapshot,
     UniversalNamePath,
-    get_diff,
+    iter_changes,
     IFileStorageAdapterProvider,
 )
+from src.plotva.common.metadata_index import MetadataIndex, ObjectMeta
 
 __all__ = [
     "plugin_init",
@@ -31,11 +64,30 @@ __all__ = [
     "CephStorage",
     "CephStorageProvider",
     "BucketSnapshot",
+    "BatchResult",
+    "ObjectCache",
+    "PresignedUrlCache",
 ]
 
 _logger = getLogger(__name__)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# S3 не принимает части multipart upload меньше 5 МБ (кроме последней)
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Сколько раз подряд ждать, пока бакет перестанет меняться
+MAX_DEBOUNCE_ROUNDS = 5
+
+# Максимум ключей в одном запросе delete_objects
+DELETE_BATCH_SIZE = 1000
+
+DEFAULT_PRESIGN_EXPIRES = 3600
+_PRESIGN_METHODS = {"GET": "get_object", "PUT": "put_object"}
+
+StreamSource = Union[bytes, str, AsyncIterable[bytes], Iterable[bytes], BinaryIO]
+
 
 def _modified(key: dict) -> int:
     """Возвращает timestamp последней модификации файла"""
@@ -46,95 +98,591 @@ def get_last_modified_to_datetime(last_modified: datetime) -> datetime:
     return last_modified.replace(tzinfo=timezone.utc)
 
 
-def _get_files(objects: List[dict]) -> Dict[str, int]:
-    files = {}
-    for obj in objects:
-        modified = _modified(obj)
-        files[obj["Key"]] = modified
-    return files
-
-
 class CephIOFileNotFoundException(FileNotFoundError):
     pass
 
 
+async def _iter_source(
+    source: StreamSource, chunk_size: int, executor: Optional[Executor] = None
+) -> AsyncIterator[bytes]:
+    """Приводит источник данных для записи к асинхронному итератору байтов"""
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield bytes(source)
+    elif hasattr(source, "__aiter__"):
+        async for chunk in source:
+            yield chunk
+    elif hasattr(source, "read"):
+        if inspect.iscoroutinefunction(source.read):
+            while chunk := await source.read(chunk_size):
+                yield chunk
+        else:
+            loop = asyncio.get_running_loop()
+            while chunk := await loop.run_in_executor(
+                executor, source.read, chunk_size
+            ):
+                yield chunk
+    else:
+        for chunk in source:
+            yield chunk
+
+
+async def _iter_parts(
+    chunks: AsyncIterator[bytes], part_size: int
+) -> AsyncIterator[bytes]:
+    """Нарезает поток на части ровно по part_size байт (последняя может быть меньше)"""
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _chain(head: List[bytes], tail: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    for part in head:
+        yield part
+    async for part in tail:
+        yield part
+
+
+def _error_code(error: Exception) -> str:
+    if isinstance(error, ClientError):
+        return error.response["Error"]["Code"]
+    return type(error).__name__
+
+
+async def _run_bounded(
+    items: Iterable[Any], worker: Callable[[Any], Awaitable[None]], limit: int
+) -> None:
+    """Обрабатывает items не более чем limit корутинами одновременно"""
+    iterator = iter(items)
+
+    async def run() -> None:
+        for item in iterator:
+            await worker(item)
+
+    await asyncio.gather(*(run() for _ in range(max(limit, 1))))
+
+
+def _byte_range(start: Optional[int], end: Optional[int]) -> Optional[str]:
+    """Заголовок Range, end включительно, как в HTTP"""
+    if start is None and end is None:
+        return None
+    return f"bytes={start or 0}-{'' if end is None else end}"
+
+
+@dataclass(slots=True, frozen=True)
+class CachedObject:
+    etag: str
+    path: str
+    validated_at: float
+
+
+class ObjectCache:
+    """
+    Read-through кэш объектов на локальном диске.
+
+    Содержимое адресуется по ETag: файл лежит в root/<hh>/<sha1(etag)>, ключи с
+    одинаковым ETag делят один файл. Ключи хранятся парой (бакет, ключ), поэтому
+    один кэш можно отдавать хранилищам разных бакетов. Размер ограничен
+    max_bytes, вытесняются давно не читанные файлы (LRU). Запись считается
+    свежей fresh_for секунд, после этого она перепроверяется запросом
+    с If-None-Match: если объект не изменился, S3 отвечает 304 без тела.
+    Отдаются обычные файлы, поэтому их можно читать через mmap или отправлять
+    sendfile (web.FileResponse).
+    Объект можно использовать из нескольких потоков.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS blobs (
+        etag TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        accessed_at REAL NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS blobs_accessed_at ON blobs (accessed_at);
+
+    -- Записи без бакета из прежних версий кэша; файлы вытеснятся по LRU
+    DROP TABLE IF EXISTS keys;
+
+    CREATE TABLE IF NOT EXISTS bucket_keys (
+        bucket TEXT NOT NULL,
+        key TEXT NOT NULL,
+        etag TEXT NOT NULL,
+        validated_at REAL NOT NULL,
+        PRIMARY KEY (bucket, key)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, root: str, max_bytes: int = 1024**3, fresh_for: float = 30.0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(root, "cache.db"),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(self._SCHEMA)
+        self._lock = threading.Lock()
+        (total,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+        self._total = total
+
+    def _blob_path(self, etag: str) -> str:
+        digest = hashlib.sha1(etag.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def fits(self, size: int) -> bool:
+        return size <= self.max_bytes
+
+    def lookup(self, bucket: str, key: str) -> Optional[CachedObject]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, validated_at FROM bucket_keys "
+                "WHERE bucket = ? AND key = ?",
+                (bucket, key),
+            ).fetchone()
+            if row is None:
+                return None
+            etag, validated_at = row
+            path = self._blob_path(etag)
+            if not os.path.exists(path):
+                self._connection.execute(
+                    "DELETE FROM bucket_keys WHERE bucket = ? AND key = ?",
+                    (bucket, key),
+                )
+                return None
+            self._connection.execute(
+                "UPDATE blobs SET accessed_at = ? WHERE etag = ?", (time.time(), etag)
+            )
+        return CachedObject(etag=etag, path=path, validated_at=validated_at)
+
+    def is_fresh(self, entry: CachedObject) -> bool:
+        return time.time() - entry.validated_at < self.fresh_for
+
+    def revalidated(self, bucket: str, key: str) -> None:
+        """Отмечает, что S3 подтвердил (304) актуальность записи"""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE bucket_keys SET validated_at = ? WHERE bucket = ? AND key = ?",
+                (time.time(), bucket, key),
+            )
+
+    def create_temp(self) -> str:
+        fd, path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        os.close(fd)
+        return path
+
+    def store(self, bucket: str, key: str, etag: str, temp_path: str) -> str:
+        """Переносит скачанный во временный файл объект в кэш и возвращает путь"""
+        path = self._blob_path(etag)
+        size = os.path.getsize(temp_path)
+        now = time.time()
+        with self._lock:
+            exists = self._connection.execute(
+                "SELECT 1 FROM blobs WHERE etag = ?", (etag,)
+            ).fetchone()
+            if exists and os.path.exists(path):
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                if not exists:
+                    self._total += size
+            self._connection.execute(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (etag, size, now)
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO bucket_keys VALUES (?, ?, ?, ?)",
+                (bucket, key, etag, now),
+            )
+            self._evict(keep=etag)
+        return path
+
+    def forget(self, bucket: str, keys: Iterable[str]) -> None:
+        """Забывает ключи бакета; файлы остаются до вытеснения"""
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM bucket_keys WHERE bucket = ? AND key = ?",
+                ((bucket, key) for key in keys),
+            )
+
+    def _evict(self, keep: str) -> None:
+        while self._total > self.max_bytes:
+            rows = self._connection.execute(
+                "SELECT etag, size FROM blobs WHERE etag != ? "
+                "ORDER BY accessed_at LIMIT 100",
+                (keep,),
+            ).fetchall()
+            if not rows:
+                return
+            for etag, size in rows:
+                try:
+                    os.unlink(self._blob_path(etag))
+                except FileNotFoundError:
+                    pass
+                self._connection.execute("DELETE FROM blobs WHERE etag = ?", (etag,))
+                self._connection.execute(
+                    "DELETE FROM bucket_keys WHERE etag = ?", (etag,)
+                )
+                self._total -= size
+                if self._total <= self.max_bytes:
+                    return
+
+    def fetch(self, client, bucket: str, key: str) -> Optional[str]:
+        """
+        Синхронный read-through для boto3 клиента: путь к актуальной копии
+        объекта или None, если объект больше всего кэша
+        """
+        entry = self.lookup(bucket, key)
+        if entry is not None and self.is_fresh(entry):
+            return entry.path
+        kwargs = {"Bucket": bucket, "Key": key}
+        if entry is not None:
+            kwargs["IfNoneMatch"] = entry.etag
+        try:
+            response = client.get_object(**kwargs)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "304":
+                self.revalidated(bucket, key)
+                return entry.path
+            if code in ("NoSuchKey", "404"):
+                self.forget(bucket, [key])
+                raise CephIOFileNotFoundException(f"{key} does not exist in {bucket}")
+            raise
+        body = response["Body"]
+        try:
+            if not self.fits(response["ContentLength"]):
+                return None
+            temp_path = self.create_temp()
+            try:
+                with open(temp_path, "wb") as f:
+                    while chunk := body.read(DEFAULT_CHUNK_SIZE):
+                        f.write(chunk)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        finally:
+            body.close()
+        return self.store(bucket, key, response["ETag"], temp_path)
+
+
+def _read_file_range(path: str, start: Optional[int], end: Optional[int]) -> bytes:
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start)
+        if end is None:
+            return f.read()
+        return f.read(max(end - (start or 0) + 1, 0))
+
+
+class _CephRangeReader(io.RawIOBase):
+    """
+    Читает объект по требованию: каждый readinto - отдельный GET с заголовком
+    Range. Поверх него BufferedReader дает read-ahead.
+    """
+
+    def __init__(self, client, bucket: str, filename: str):
+        super().__init__()
+        self._client = client
+        self._bucket = bucket
+        self._filename = filename
+        self._position = 0
+        try:
+            head = client.head_object(Bucket=bucket, Key=filename)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                raise CephIOFileNotFoundException(
+                    f"{filename} does not exist in {bucket}"
+                )
+            raise
+        self._size: int = head["ContentLength"]
+        # Диапазоны читаются только из той версии объекта, которую открыли
+        self._etag: str = head["ETag"]
+
+    @property
+    def name(self) -> str:
+        return self._filename
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"negative seek position {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self._size or not len(buffer):
+            return 0
+        end = min(self._position + len(buffer), self._size) - 1
+        response = self._client.get_object(
+            Bucket=self._bucket,
+            Key=self._filename,
+            Range=f"bytes={self._position}-{end}",
+            IfMatch=self._etag,
+        )
+        data = response["Body"].read()
+        memoryview(buffer).cast("B")[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class _CephMultipartWriter(io.RawIOBase):
+    """
+    Пишет объект частями по part_size байт через multipart upload. Если данных
+    меньше одной части, при закрытии отправляется обычный put_object.
+    """
+
+    def __init__(self, client, bucket: str, filename: str, part_size: int):
+        super().__init__()
+        self._client = client
+        self._bucket = bucket
+        self._filename = filename
+        self._part_size = max(part_size, MIN_PART_SIZE)
+        self._buffer = bytearray()
+        self._parts: List[dict] = []
+        self._upload_id: Optional[str] = None
+        self._written = 0
+        self._aborted = False
+
+    @property
+    def name(self) -> str:
+        return self._filename
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._written
+
+    def write(self, data) -> int:
+        size = len(memoryview(data).cast("B"))
+        if self._aborted:
+            return size
+        self._buffer += data
+        self._written += size
+        while len(self._buffer) >= self._part_size:
+            self._upload_part(bytes(self._buffer[: self._part_size]))
+            del self._buffer[: self._part_size]
+        return size
+
+    def _upload_part(self, data: bytes) -> None:
+        if self._upload_id is None:
+            upload = self._client.create_multipart_upload(
+                Bucket=self._bucket, Key=self._filename
+            )
+            self._upload_id = upload["UploadId"]
+        number = len(self._parts) + 1
+        response = self._client.upload_part(
+            Bucket=self._bucket,
+            Key=self._filename,
+            UploadId=self._upload_id,
+            PartNumber=number,
+            Body=data,
+        )
+        self._parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+    def abort(self) -> None:
+        """Отменяет запись: загруженные части удаляются, объект не создается"""
+        self._aborted = True
+        self._buffer.clear()
+        if self._upload_id is not None:
+            self._client.abort_multipart_upload(
+                Bucket=self._bucket, Key=self._filename, UploadId=self._upload_id
+            )
+            self._upload_id = None
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self._aborted:
+                return
+            if self._upload_id is None:
+                self._client.put_object(
+                    Bucket=self._bucket, Key=self._filename, Body=bytes(self._buffer)
+                )
+                return
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self._client.complete_multipart_upload(
+                Bucket=self._bucket,
+                Key=self._filename,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            super().close()
+
+
 class CephIO(IO[AnyStr]):
-    def __init__(self, client, bucket: str, filename: str, mode: str):
+    """
+    Файл в бакете. На чтение ("r", "rb") объект не скачивается целиком: байты
+    подгружаются Range запросами блоками по read_ahead, поддерживаются seek/tell
+    и построчная итерация. С cache объект читается из локальной копии (см.
+    ObjectCache), и fileno подходит для mmap. На запись ("w", "wb") данные уходят
+    через multipart upload частями по part_size; при исключении внутри with
+    загрузка отменяется.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        filename: str,
+        mode: str,
+        read_ahead: int = DEFAULT_CHUNK_SIZE,
+        part_size: int = DEFAULT_PART_SIZE,
+        cache: Optional[ObjectCache] = None,
+    ):
+        if mode not in ("r", "rb", "w", "wb"):
+            raise ValueError(f"invalid mode: {mode!r}")
         self.client = client
         self.bucket = bucket
         self.filename = filename
         self._mode = mode
-        self.buffer = io.BytesIO() if "b" in mode else io.StringIO()
-
-    def __enter__(self) -> Any:
-        try:
-            response = self.client.get_object(Bucket=self.bucket, Key=self.filename)
-            data = response["Body"].read()
-            if "b" in self._mode:
-                self.buffer.write(data)
+        self._read_ahead = read_ahead
+        self._part_size = part_size
+        self._cache = cache
+        self._raw: Optional[io.RawIOBase] = None
+        self._stream: Optional[IO] = None
+
+    def _open_cached(self) -> Optional[IO]:
+        for _ in range(2):
+            cached_path = self._cache.fetch(self.client, self.bucket, self.filename)
+            if cached_path is None:
+                return None
+            try:
+                return open(cached_path, "rb")
+            except FileNotFoundError:
+                # Файл вытеснили между fetch и open: fetch скачает объект заново
+                continue
+        return None
+
+    def _get_stream(self) -> IO:
+        if self._stream is None:
+            if "r" in self._mode:
+                stream = self._open_cached() if self._cache is not None else None
+                if stream is None:
+                    self._raw = _CephRangeReader(
+                        self.client, self.bucket, self.filename
+                    )
+                    stream = io.BufferedReader(self._raw, buffer_size=self._read_ahead)
             else:
-                self.buffer.write(data.decode("utf-8"))
-            self.buffer.seek(0)
-            return self.buffer
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "NoSuchKey":
-                raise CephIOFileNotFoundException(
-                    f"{self.filename} does not exist in {self.bucket}"
+                if self._cache is not None:
+                    self._cache.forget(self.bucket, [self.filename])
+                self._raw = _CephMultipartWriter(
+                    self.client, self.bucket, self.filename, self._part_size
                 )
+                stream = self._raw
+            if "b" not in self._mode:
+                stream = io.TextIOWrapper(stream, encoding="utf-8")
+                # По умолчанию TextIOWrapper читает по 8 КБ через read1,
+                # и каждое такое чтение становится отдельным запросом
+                stream._CHUNK_SIZE = self._read_ahead
+            self._stream = stream
+        return self._stream
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    @property
+    def name(self) -> str:
+        return self.filename
+
+    @property
+    def closed(self) -> bool:
+        return self._stream is not None and self._stream.closed
+
+    def __enter__(self) -> "CephIO[AnyStr]":
+        self._get_stream()
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.buffer.close()
+        if exc_type is not None and isinstance(self._raw, _CephMultipartWriter):
+            self._raw.abort()
+        self.close()
 
     def close(self) -> None:
-        pass
+        if self._stream is not None:
+            self._stream.close()
 
     def fileno(self) -> int:
-        pass
+        return self._get_stream().fileno()
 
     def flush(self) -> None:
-        pass
+        self._get_stream().flush()
 
     def isatty(self) -> bool:
-        pass
+        return False
 
-    def read(self, n: int = ...) -> AnyStr:
-        pass
+    def read(self, n: int = -1) -> AnyStr:
+        return self._get_stream().read(n)
 
     def readable(self) -> bool:
-        pass
+        return "r" in self._mode
 
-    def readline(self, limit: int = ...) -> AnyStr:
-        pass
+    def readline(self, limit: int = -1) -> AnyStr:
+        return self._get_stream().readline(limit)
 
-    def readlines(self, hint: int = ...) -> List[AnyStr]:
-        pass
+    def readlines(self, hint: int = -1) -> List[AnyStr]:
+        return self._get_stream().readlines(hint)
 
-    def seek(self, offset: int, whence: int = ...) -> int:
-        pass
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._get_stream().seek(offset, whence)
 
     def seekable(self) -> bool:
-        pass
+        return "r" in self._mode
 
     def tell(self) -> int:
-        pass
+        return self._get_stream().tell()
 
-    def truncate(self, size: Optional[int] = ...) -> int:
-        pass
+    def truncate(self, size: Optional[int] = None) -> int:
+        raise io.UnsupportedOperation("truncate")
 
     def writable(self) -> bool:
-        pass
+        return "w" in self._mode
 
     def write(self, s: AnyStr) -> int:
-        pass
+        return self._get_stream().write(s)
 
     def writelines(self, lines: Iterable[AnyStr]) -> None:
-        pass
+        self._get_stream().writelines(lines)
 
     def __iter__(self) -> Iterator[AnyStr]:
-        pass
+        return self
 
     def __next__(self) -> AnyStr:
-        pass
+        return next(self._get_stream())
 
 
 @dataclass(slots=True, frozen=True, eq=True, hash=True)
@@ -142,6 +690,7 @@ class CephFile(IFile):
     _path: PurePath
     _obj: dict
     _client: Any
+    _cache: Optional[ObjectCache] = None
 
     def get_path(self) -> PurePath:
         return self._path
@@ -155,41 +704,93 @@ class CephFile(IFile):
             bucket=self._obj["Bucket"],
             filename=str(self._path),
             mode=mode,
+            cache=self._cache,
         )
 
     def get_universal_name_path(self) -> UniversalNamePath:
         return UniversalNamePath(value=str(self._path))
 
 
+def _object_meta(obj: dict) -> ObjectMeta:
+    return ObjectMeta(
+        key=obj["Key"], etag=obj["ETag"], size=obj["Size"], modified=_modified(obj)
+    )
+
+
+def _meta_object(meta: ObjectMeta, bucket: str) -> dict:
+    """Запись индекса в формате элемента Contents из list_objects_v2"""
+    return {
+        "Key": meta.key,
+        "ETag": meta.etag,
+        "Size": meta.size,
+        "LastModified": datetime.fromtimestamp(meta.modified / 1e6, tz=timezone.utc),
+        "Bucket": bucket,
+    }
+
+
 class CephAdapter(IFileStorageAdapter):
-    def __init__(self, client, bucket: str, prefix: str = ""):
+    """
+    Адаптер бакета. С index листинг хранится в локальном MetadataIndex:
+    glob обслуживается из индекса, а refresh может обновить только часть
+    префикса адаптера вместо листинга всего бакета.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        prefix: str = "",
+        index: Optional[MetadataIndex] = None,
+        cache: Optional[ObjectCache] = None,
+    ):
         self.client = client
         self.bucket = bucket
         self.prefix = prefix
-        self._diff: Diff = Diff(not_modified=self._list_files())
-
-    def _list_files(self) -> Dict[str, int]:
+        self.index = index
+        self.cache = cache
+        if index is None:
+            self._files: SortedSnapshot = self._list_files()
+        elif index.last_refresh(prefix) is None:
+            index.refresh_prefix(prefix, self._iter_objects(prefix))
+
+    def _iter_objects(self, prefix: str) -> Iterator[ObjectMeta]:
         paginator = self.client.get_paginator("list_objects_v2")
-        page_iterator = paginator.paginate(Bucket=self.bucket, Prefix=self.prefix)
-        objects = []
+        page_iterator = paginator.paginate(Bucket=self.bucket, Prefix=prefix)
         for page in page_iterator:
-            objects.extend(page.get("Contents", []))
-        return _get_files(objects)
+            for obj in page.get("Contents", []):
+                yield _object_meta(obj)
+
+    def _list_files(self) -> SortedSnapshot:
+        return SortedSnapshot.from_items(
+            (meta.key, meta.modified) for meta in self._iter_objects(self.prefix)
+        )
 
     def open(self, filename, mode="r", *args, **kwargs) -> CephIO[Any]:
         return CephIO(
-            client=self.client, bucket=self.bucket, filename=filename, mode=mode
+            client=self.client,
+            bucket=self.bucket,
+            filename=filename,
+            mode=mode,
+            cache=self.cache,
         )
 
     def glob(self, pattern: str):
-        paginator = self.client.get_paginator("list_objects_v2")
-        page_iterator = paginator.paginate(Bucket=self.bucket, Prefix=self.prefix)
-        for page in page_iterator:
-            for obj in page.get("Contents", []):
-                if fnmatch.fnmatch(obj["Key"], pattern):
-                    yield CephFile(
-                        path=PurePath(obj["Key"]), _obj=obj, _client=self.client
-                    )
+        if self.index is not None:
+            metas = self.index.glob(pattern)
+        else:
+            metas = (
+                meta
+                for meta in self._iter_objects(self.prefix)
+                if fnmatch.fnmatch(meta.key, pattern)
+            )
+        for meta in metas:
+            if meta.key.startswith(self.prefix):
+                yield CephFile(
+                    path=PurePath(meta.key),
+                    obj=_meta_object(meta, self.bucket),
+                    client=self.client,
+                    cache=self.cache,
+                )
 
     def path_exist(self, path: UniversalNamePath) -> bool:
         _path = os.path.join(self.prefix, path.value)
@@ -199,26 +800,60 @@ class CephAdapter(IFileStorageAdapter):
         except ClientError:
             return False
 
-    def refresh(self) -> Diff:
-        old_files = self._diff.get_files()
-        new_files = self._list_files()
-        new_diff = get_diff(old_files=old_files, new_files=new_files)
-        self._diff = new_diff
-        return new_diff
+    def refresh(self, prefix: str = "") -> Diff:
+        """
+        Возвращает изменения с прошлого обновления. С индексом prefix (относительно
+        префикса адаптера) ограничивает листинг частью ключей.
+        """
+        if self.index is not None:
+            prefix = self.prefix + prefix
+            return self.index.refresh_prefix(prefix, self._iter_objects(prefix))
+        old_files, self._files = self._files, self._list_files()
+        return Diff.from_changes(
+            iter_changes(old_files, self._files, include_unchanged=True)
+        )
+
+    def refresh_changes(self) -> Iterator[Change]:
+        """
+        Как refresh, но без индекса изменения выдаются потоком, без словарей
+        и без неизмененных файлов
+        """
+        if self.index is not None:
+            diff = self.refresh()
+            return itertools.chain(
+                (Change(NEW, key, value) for key, value in diff.new.items()),
+                (Change(MODIFIED, key, value) for key, value in diff.modified.items()),
+                (Change(DELETED, key, value) for key, value in diff.deleted.items()),
+            )
+        old_files, self._files = self._files, self._list_files()
+        return iter_changes(old_files, self._files)
 
 
 class CephAdapterProvider(IFileStorageAdapterProvider):
     class Meta:
         name = "ceph"
 
-    def __init__(self, client, bucket_name: str, prefix: str = ""):
+    def __init__(
+        self,
+        client,
+        bucket_name: str,
+        prefix: str = "",
+        index: Optional[MetadataIndex] = None,
+        cache: Optional[ObjectCache] = None,
+    ):
         self.client = client
         self.bucket_name = bucket_name
         self.prefix = prefix
+        self.index = index
+        self.cache = cache
 
     def get_adapter(self) -> CephAdapter:
         return CephAdapter(
-            client=self.client, bucket=self.bucket_name, prefix=self.prefix
+            client=self.client,
+            bucket=self.bucket_name,
+            prefix=self.prefix,
+            index=self.index,
+            cache=self.cache,
         )
 
 
@@ -227,49 +862,149 @@ class BucketSnapshotDiff:
     new: Set[str]
     removed: Set[str]
     modified: Set[str]
+    # Состояние после изменений; его можно сохранить и передать в watch(since=...)
+    snapshot: Optional["BucketSnapshot"] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.new or self.removed or self.modified)
+
+
+@dataclass(slots=True)
+class BatchResult:
+    """Результат пакетной операции для одного ключа"""
+
+    key: str
+    ok: bool
+    error: Optional[str] = None
+    data: Optional[bytes] = None
+
+
+class PresignedUrlCache:
+    """
+    Подписанные ссылки в памяти (LRU на max_entries записей). Ссылка отдается
+    повторно, пока до ее истечения больше refresh_margin секунд (но не меньше
+    половины срока жизни), так что подпись не считается на каждый запрос, а
+    одинаковые ссылки позволяют клиентам кэшировать сами файлы.
+    """
+
+    def __init__(self, max_entries: int = 10000, refresh_margin: float = 60.0):
+        self.max_entries = max_entries
+        self.refresh_margin = refresh_margin
+        self._entries: "OrderedDict[Tuple, Tuple[str, float, float]]" = OrderedDict()
+
+    def get(self, key: Tuple) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        url, expires_at, expires_in = entry
+        margin = min(self.refresh_margin, expires_in / 2)
+        if expires_at - time.time() <= margin:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return url
+
+    def put(self, key: Tuple, url: str, expires_at: float, expires_in: float) -> None:
+        self._entries[key] = (url, expires_at, expires_in)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(self, filenames: Iterable[str]) -> None:
+        filenames = set(filenames)
+        for key in [key for key in self._entries if key[1] in filenames]:
+            del self._entries[key]
+
+
+def _etag_snapshot(snapshot: Union[Dict[str, str], SortedSnapshot]) -> SortedSnapshot:
+    if isinstance(snapshot, SortedSnapshot):
+        return snapshot
+    return SortedSnapshot.from_dict(snapshot, typecode=None)
 
 
 @dataclass(slots=True)
 class BucketSnapshot:
-    _snapshot: Dict[str, str]
+    """Снимок key -> ETag; хранится отсортированным, сравнивается merge-join"""
+
+    _snapshot: SortedSnapshot = attrib(converter=_etag_snapshot)
+
+    @classmethod
+    def from_items(cls, items: Iterable[Tuple[str, str]]) -> "BucketSnapshot":
+        return cls(SortedSnapshot.from_items(items, typecode=None))
 
     def keys(self) -> Set[str]:
-        return set(self._snapshot.keys())
+        return set(self._snapshot.keys)
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._snapshot
 
     def __str__(self) -> str:
-        return f"BucketSnapshot({', '.join(self.keys())})"
+        return f"BucketSnapshot({', '.join(self._snapshot.keys)})"
 
     def __getitem__(self, key: str) -> str:
         return self._snapshot[key]
 
+    def save(self, path: str) -> None:
+        """Атомарно сохраняет снимок в JSON файл"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"keys": self._snapshot.keys, "etags": list(self._snapshot.values)}, f
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BucketSnapshot":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls.from_items(zip(data["keys"], data["etags"]))
+
+    def iter_changes(self, other: "BucketSnapshot") -> Iterator[Change]:
+        """Изменения от этого снимка к other по одному, в порядке ключей"""
+        return iter_changes(self._snapshot, other._snapshot)
+
     def __sub__(self, other: "BucketSnapshot") -> BucketSnapshotDiff:
-        new = other.keys() - self.keys()
-        removed = self.keys() - other.keys()
-        modified = {
-            key for key in self.keys() & other.keys() if other[key] != self[key]
-        }
-        return BucketSnapshotDiff(new=new, modified=modified, removed=removed)
+        diff = BucketSnapshotDiff(new=set(), removed=set(), modified=set())
+        for kind, key, _ in self.iter_changes(other):
+            if kind == NEW:
+                diff.new.add(key)
+            elif kind == DELETED:
+                diff.removed.add(key)
+            else:
+                diff.modified.add(key)
+        return diff
 
 
 def create_snapshot(client, bucket: str, prefix: str = "") -> BucketSnapshot:
     paginator = client.get_paginator("list_objects_v2")
     page_iterator = paginator.paginate(Bucket=bucket, Prefix=prefix)
-    snapshot = {}
-    for page in page_iterator:
-        for obj in page.get("Contents", []):
-            snapshot[obj["Key"]] = obj["ETag"]
-    return BucketSnapshot(snapshot)
+    return BucketSnapshot.from_items(
+        (obj["Key"], obj["ETag"])
+        for page in page_iterator
+        for obj in page.get("Contents", [])
+    )
 
 
 async def create_snapshot_with_debounce(
     client, bucket: str, prefix: str = "", refresh_debounce_period_seconds: float = 2.0
 ) -> BucketSnapshot:
-    current_snapshot = create_snapshot(client, bucket, prefix)
-    await asyncio.sleep(refresh_debounce_period_seconds)
-    new_snapshot = create_snapshot(client, bucket, prefix)
-    if _diff := current_snapshot - new_snapshot:
-        current_snapshot = new_snapshot
-    return new_snapshot
+    """
+    Снимок, после которого бакет не менялся refresh_debounce_period_seconds
+    (но не больше MAX_DEBOUNCE_ROUNDS попыток)
+    """
+    loop = asyncio.get_running_loop()
+    take_snapshot = partial(create_snapshot, client, bucket, prefix)
+    snapshot = await loop.run_in_executor(None, take_snapshot)
+    for _ in range(MAX_DEBOUNCE_ROUNDS):
+        await asyncio.sleep(refresh_debounce_period_seconds)
+        newer = await loop.run_in_executor(None, take_snapshot)
+        if not snapshot - newer:
+            return newer
+        snapshot = newer
+    return snapshot
 
 
 def get_or_create_bucket(client, bucket_name: str) -> None:
@@ -289,114 +1024,549 @@ def get_or_create_bucket(client, bucket_name: str) -> None:
 
 @dataclass(slots=True)
 class CephStorage:
+    """
+    Асинхронный интерфейс к бакету поверх синхронного boto3 клиента.
+
+    Все запросы, включая постраничный листинг, выполняются через _call в отдельном
+    пуле из max_concurrency потоков, поэтому не блокируют event loop и не занимают
+    пул по умолчанию. Асинхронный бэкенд (см. s3_async.py) переопределяет только
+    _call, _read_body, _iter_body и _presign.
+
+    С index список файлов берется из локального MetadataIndex, а не листингом
+    бакета. Индекс отражает состояние на момент последнего refresh_index по
+    префиксу (удаления через это хранилище учитываются сразу).
+
+    С cache чтения целиком (read_file, read_bytes, get_many, cached_path) идут
+    через локальный ObjectCache; запись и удаление через это хранилище
+    сбрасывают закэшированные ключи.
+
+    presigned_url выдает ссылки для прямого обмена клиента с Ceph; подписи
+    переиспользуются из presigned_urls почти до истечения срока.
+    """
+
     bucket_name: str
     client: Any
     create_snapshot_with_debounce: float = 2.0
-    _loop: Optional[AbstractEventLoop] = None
+    max_concurrency: int = 32
+    index: Optional[MetadataIndex] = None
+    cache: Optional[ObjectCache] = None
+    presigned_urls: PresignedUrlCache = attrib(factory=PresignedUrlCache)
+    _executor: Optional[ThreadPoolExecutor] = attrib(init=False, default=None)
 
     def __attrs_post_init__(self) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="ceph-storage"
+        )
         get_or_create_bucket(self.client, self.bucket_name)
 
-    async def _get_loop(self) -> AbstractEventLoop:
-        return asyncio.get_event_loop()
+    async def _call(self, method: str, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(getattr(self.client, method), **kwargs)
+        )
+
+    async def _read_body(self, response: dict) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, response["Body"].read)
+
+    async def _iter_body(self, response: dict, chunk_size: int) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        body = response["Body"]
+        try:
+            while chunk := await loop.run_in_executor(
+                self._executor, body.read, chunk_size
+            ):
+                yield chunk
+        finally:
+            body.close()
+
+    async def _iter_objects(self, prefix: str = "") -> AsyncIterator[dict]:
+        """Постраничный list_objects_v2, каждая страница - отдельный _call"""
+        kwargs = {"Bucket": self.bucket_name, "Prefix": prefix}
+        while True:
+            page = await self._call("list_objects_v2", **kwargs)
+            for obj in page.get("Contents", []):
+                yield obj
+            if not page.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+    async def _presign(
+        self, method: str, params: Dict[str, Any], expires_in: int
+    ) -> str:
+        # Подпись считается локально без запросов к Ceph, поток не нужен
+        return self.client.generate_presigned_url(
+            method, Params=params, ExpiresIn=expires_in
+        )
+
+    async def _run_sync(self, func: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def refresh_index(self, prefix: str = "") -> Diff:
+        """Перечитывает из бакета только ключи с prefix и возвращает изменения"""
+        if self.index is None:
+            raise RuntimeError("CephStorage is created without index")
+        refresh = await self._run_sync(self.index.begin_refresh, prefix)
+        try:
+            page: List[ObjectMeta] = []
+            async for obj in self._iter_objects(prefix):
+                page.append(_object_meta(obj))
+                if len(page) >= 1000:
+                    await self._run_sync(refresh.add, page)
+                    page = []
+            await self._run_sync(refresh.add, page)
+        except BaseException:
+            await self._run_sync(refresh.cancel)
+            raise
+        return await self._run_sync(refresh.finish)
+
+    async def _indexed_objects(self, prefix: str = "") -> List[ObjectMeta]:
+        if await self._run_sync(self.index.last_refresh, prefix) is None:
+            await self.refresh_index(prefix)
+        return await self._run_sync(lambda: list(self.index.iter_prefix(prefix)))
+
+    async def ensure_bucket(self) -> None:
+        try:
+            await self._call("head_bucket", Bucket=self.bucket_name)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchBucket"):
+                raise
+            await self._call("create_bucket", Bucket=self.bucket_name)
+            _logger.info(f"Бакет {self.bucket_name} создан")
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=False)
 
     async def exists(self, filename: str) -> bool:
-        loop = await self._get_loop()
         try:
-            await loop.run_in_executor(
-                None,
-                partial(self.client.head_object, Bucket=self.bucket_name, Key=filename),
-            )
+            await self._call("head_object", Bucket=self.bucket_name, Key=filename)
             return True
         except ClientError:
             return False
 
+    async def _forget_cached(self, keys: List[str]) -> None:
+        # Новое содержимое - новая ссылка, иначе клиенты покажут закэшированное старое
+        self.presigned_urls.forget(keys)
+        if self.cache is not None:
+            await self._run_sync(self.cache.forget, self.bucket_name, keys)
+
+    async def cached_path(self, filename: str) -> Optional[str]:
+        """
+        Путь к локальной копии объекта в cache или None, если объект больше
+        всего кэша. Устаревшая запись перепроверяется запросом с If-None-Match.
+        Файл может быть вытеснен до того, как его откроют: на FileNotFoundError
+        нужно повторить вызов.
+        """
+        if self.cache is None:
+            raise RuntimeError("CephStorage is created without cache")
+        cache = self.cache
+        entry = await self._run_sync(cache.lookup, self.bucket_name, filename)
+        if entry is not None and cache.is_fresh(entry):
+            return entry.path
+        kwargs = {"Bucket": self.bucket_name, "Key": filename}
+        if entry is not None:
+            kwargs["IfNoneMatch"] = entry.etag
+        try:
+            response = await self._call("get_object", **kwargs)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "304":
+                await self._run_sync(cache.revalidated, self.bucket_name, filename)
+                return entry.path
+            if code in ("NoSuchKey", "404"):
+                await self._forget_cached([filename])
+                raise CephIOFileNotFoundException(
+                    f"{filename} does not exist in {self.bucket_name}"
+                )
+            raise
+        if not cache.fits(response["ContentLength"]):
+            response["Body"].close()
+            return None
+        temp_path = await self._run_sync(cache.create_temp)
+        try:
+            with open(temp_path, "wb") as f:
+                async for chunk in self._iter_body(response, DEFAULT_CHUNK_SIZE):
+                    await self._run_sync(f.write, chunk)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return await self._run_sync(
+            cache.store, self.bucket_name, filename, response["ETag"], temp_path
+        )
+
+    async def presigned_url(
+        self,
+        filename: str,
+        method: str = "GET",
+        expires_in: int = DEFAULT_PRESIGN_EXPIRES,
+        content_type: Optional[str] = None,
+    ) -> str:
+        """
+        Подписанная ссылка на GET или PUT файла, действующая expires_in секунд.
+        Для PUT с content_type клиент обязан передать такой же Content-Type.
+        """
+        client_method = _PRESIGN_METHODS.get(method.upper())
+        if client_method is None:
+            raise ValueError(f"Unsupported presigned method: {method}")
+        key = (client_method, filename, expires_in, content_type)
+        url = self.presigned_urls.get(key)
+        if url is not None:
+            return url
+        params = {"Bucket": self.bucket_name, "Key": filename}
+        if content_type is not None:
+            params["ContentType"] = content_type
+        expires_at = time.time() + expires_in
+        url = await self._presign(client_method, params, expires_in)
+        self.presigned_urls.put(key, url, expires_at, expires_in)
+        return url
+
     async def write_file(self, filename: str, content: AnyStr) -> None:
-        loop = await self._get_loop()
         if isinstance(content, str):
             content = content.encode("utf-8")
-        await loop.run_in_executor(
-            None,
-            partial(
-                self.client.put_object,
-                Bucket=self.bucket_name,
-                Key=filename,
-                Body=content,
-            ),
+        await self._call(
+            "put_object", Bucket=self.bucket_name, Key=filename, Body=content
         )
+        await self._forget_cached([filename])
+
+    async def write_stream(
+        self,
+        filename: str,
+        source: StreamSource,
+        part_size: int = DEFAULT_PART_SIZE,
+        multipart_threshold: int = DEFAULT_PART_SIZE,
+        max_parallel_parts: int = 4,
+    ) -> None:
+        """
+        Потоковая запись из байтов, (асинхронного) итератора чанков или файлового
+        объекта. До multipart_threshold байт данные уходят одним put_object, иначе
+        через multipart upload: одновременно загружается до max_parallel_parts
+        частей, так что в памяти не больше (max_parallel_parts + 1) * part_size байт.
+        """
+        part_size = max(part_size, MIN_PART_SIZE)
+        parts = _iter_parts(_iter_source(source, part_size, self._executor), part_size)
+
+        head: List[bytes] = []
+        size = 0
+        multipart = False
+        async for part in parts:
+            head.append(part)
+            size += len(part)
+            if size > multipart_threshold:
+                multipart = True
+                break
+
+        if multipart:
+            await self._multipart_upload(
+                filename, _chain(head, parts), max_parallel_parts
+            )
+        else:
+            await self._call(
+                "put_object", Bucket=self.bucket_name, Key=filename, Body=b"".join(head)
+            )
+        await self._forget_cached([filename])
 
-    async def remove_files_by_pattern(self, pattern: str) -> None:
-        loop = await self._get_loop()
-        paginator = self.client.get_paginator("list_objects_v2")
-        page_iterator = paginator.paginate(Bucket=self.bucket_name)
+    async def _multipart_upload(
+        self, filename: str, parts: AsyncIterator[bytes], max_parallel_parts: int
+    ) -> None:
+        upload = await self._call(
+            "create_multipart_upload", Bucket=self.bucket_name, Key=filename
+        )
+        upload_id = upload["UploadId"]
+        etags: Dict[int, str] = {}
+        errors: List[BaseException] = []
+        slots = asyncio.Semaphore(max_parallel_parts)
 
-        keys_to_remove = []
-        for page in page_iterator:
-            for obj in page.get("Contents", []):
-                if fnmatch.fnmatch(obj["Key"], pattern):
-                    keys_to_remove.append({"Key": obj["Key"]})
-
-        if keys_to_remove:
-            await loop.run_in_executor(
-                None,
-                partial(
-                    self.client.delete_objects,
+        async def upload_part(number: int, data: bytes) -> None:
+            try:
+                response = await self._call(
+                    "upload_part",
                     Bucket=self.bucket_name,
-                    Keys=keys_to_remove,
-                ),
+                    Key=filename,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    Body=data,
+                )
+                etags[number] = response["ETag"]
+            except Exception as e:
+                errors.append(e)
+                raise
+            finally:
+                slots.release()
+
+        tasks: List[asyncio.Task] = []
+        try:
+            number = 0
+            async for data in parts:
+                await slots.acquire()
+                if errors:
+                    break
+                number += 1
+                tasks.append(asyncio.create_task(upload_part(number, data)))
+            await asyncio.gather(*tasks)
+            await self._call(
+                "complete_multipart_upload",
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"PartNumber": number, "ETag": etag}
+                        for number, etag in sorted(etags.items())
+                    ]
+                },
             )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                await self._call(
+                    "abort_multipart_upload",
+                    Bucket=self.bucket_name,
+                    Key=filename,
+                    UploadId=upload_id,
+                )
+            except ClientError:
+                _logger.warning(
+                    f"Не удалось отменить загрузку {filename}", exc_info=True
+                )
+            raise
+
+    async def read_stream(
+        self,
+        filename: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        """
+        Читает файл чанками по chunk_size байт, не загружая его целиком в память.
+        start и end (включительно) задают диапазон байтов для Range запроса.
+        """
+        kwargs = {"Bucket": self.bucket_name, "Key": filename}
+        byte_range = _byte_range(start, end)
+        if byte_range is not None:
+            kwargs["Range"] = byte_range
+        try:
+            response = await self._call("get_object", **kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                raise CephIOFileNotFoundException(
+                    f"{filename} does not exist in {self.bucket_name}"
+                )
+            raise
+        async for chunk in self._iter_body(response, chunk_size):
+            yield chunk
+
+    async def read_bytes(
+        self, filename: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Optional[bytes]:
+        if self.cache is not None:
+            for _ in range(2):
+                try:
+                    path = await self.cached_path(filename)
+                except CephIOFileNotFoundException:
+                    return None
+                if path is None:
+                    break
+                try:
+                    return await self._run_sync(_read_file_range, path, start, end)
+                except FileNotFoundError:
+                    # Файл вытеснили между cached_path и open: скачиваем заново
+                    continue
+        try:
+            chunks = [chunk async for chunk in self.read_stream(filename, start, end)]
+        except CephIOFileNotFoundException:
+            return None
+        return b"".join(chunks)
+
+    async def put_many(
+        self,
+        items: Union[Dict[str, StreamSource], Iterable[Tuple[str, StreamSource]]],
+        max_concurrency: Optional[int] = None,
+    ) -> Dict[str, BatchResult]:
+        """Записывает файлы параллельно, ошибка одного ключа не прерывает остальные"""
+        pairs = list(items.items() if isinstance(items, dict) else items)
+        results = {key: BatchResult(key=key, ok=False) for key, _ in pairs}
+
+        async def put(pair: Tuple[str, StreamSource]) -> None:
+            key, content = pair
+            try:
+                await self.write_stream(key, content)
+                results[key] = BatchResult(key=key, ok=True)
+            except (ClientError, BotoCoreError) as e:
+                results[key] = BatchResult(key=key, ok=False, error=_error_code(e))
+
+        await _run_bounded(pairs, put, max_concurrency or self.max_concurrency)
+        return results
+
+    async def get_many(
+        self, keys: Iterable[str], max_concurrency: Optional[int] = None
+    ) -> Dict[str, BatchResult]:
+        """Читает файлы параллельно; для отсутствующих ключей ошибка NoSuchKey"""
+        keys = list(dict.fromkeys(keys))
+        results = {key: BatchResult(key=key, ok=False) for key in keys}
+
+        async def get(key: str) -> None:
+            try:
+                data = await self.read_bytes(key)
+                if data is None:
+                    results[key] = BatchResult(key=key, ok=False, error="NoSuchKey")
+                else:
+                    results[key] = BatchResult(key=key, ok=True, data=data)
+            except (ClientError, BotoCoreError) as e:
+                results[key] = BatchResult(key=key, ok=False, error=_error_code(e))
+
+        await _run_bounded(keys, get, max_concurrency or self.max_concurrency)
+        return results
+
+    async def delete_many(
+        self, keys: Iterable[str], max_concurrency: Optional[int] = None
+    ) -> Dict[str, BatchResult]:
+        """
+        Удаляет файлы запросами delete_objects по DELETE_BATCH_SIZE ключей,
+        запросы выполняются параллельно. Удаление отсутствующего ключа - успех.
+        """
+        keys = list(dict.fromkeys(keys))
+        results = {key: BatchResult(key=key, ok=True) for key in keys}
+        chunks = [
+            keys[i : i + DELETE_BATCH_SIZE]
+            for i in range(0, len(keys), DELETE_BATCH_SIZE)
+        ]
+
+        async def delete(chunk: List[str]) -> None:
+            try:
+                response = await self._call(
+                    "delete_objects",
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+                )
+            except (ClientError, BotoCoreError) as e:
+                for key in chunk:
+                    results[key] = BatchResult(key=key, ok=False, error=_error_code(e))
+                return
+            for error in response.get("Errors", []):
+                key = error["Key"]
+                results[key] = BatchResult(key=key, ok=False, error=error.get("Code"))
+
+        await _run_bounded(chunks, delete, max_concurrency or self.max_concurrency)
+        removed = [result.key for result in results.values() if result.ok]
+        if self.index is not None:
+            await self._run_sync(self.index.remove, removed)
+        await self._forget_cached(removed)
+        return results
+
+    async def remove_files_by_pattern(self, pattern: str) -> None:
+        keys_to_remove = [
+            obj["Key"]
+            async for obj in self._iter_objects()
+            if fnmatch.fnmatch(obj["Key"], pattern)
+        ]
+        results = await self.delete_many(keys_to_remove)
+        failed = [result.key for result in results.values() if not result.ok]
+        if failed:
+            _logger.warning(f"Не удалось удалить {len(failed)} файлов: {failed[:10]}")
 
     async def remove_file(self, filename: str) -> None:
-        loop = await self._get_loop()
-        await loop.run_in_executor(
-            None,
-            partial(self.client.delete_object, Bucket=self.bucket_name, Key=filename),
-        )
+        await self._call("delete_object", Bucket=self.bucket_name, Key=filename)
+        if self.index is not None:
+            await self._run_sync(self.index.remove, [filename])
+        await self._forget_cached([filename])
 
     async def read_file(self, filename: str) -> Optional[str]:
-        loop = await self._get_loop()
+        if self.cache is not None:
+            content = await self.read_bytes(filename)
+            return content.decode("utf-8") if content is not None else None
         try:
-            response = await loop.run_in_executor(
-                None,
-                partial(self.client.get_object, Bucket=self.bucket_name, Key=filename),
+            response = await self._call(
+                "get_object", Bucket=self.bucket_name, Key=filename
             )
-            content = await self._loop.run_in_executor(None, response["Body"].read)
+            content = await self._read_body(response)
             return content.decode("utf-8")
         except ClientError:
             return None
 
-    async def get_snapshot(self) -> BucketSnapshot:
-        return await create_snapshot_with_debounce(
-            self.client,
-            self.bucket_name,
-            refresh_debounce_period_seconds=self.create_snapshot_with_debounce,
+    async def _create_snapshot(self, prefix: str = "") -> BucketSnapshot:
+        if self.index is not None:
+            await self.refresh_index(prefix)
+            objects = await self._indexed_objects(prefix)
+            return BucketSnapshot.from_items((meta.key, meta.etag) for meta in objects)
+        return BucketSnapshot.from_items(
+            [(obj["Key"], obj["ETag"]) async for obj in self._iter_objects(prefix)]
         )
 
+    async def _settle(self, prefix: str, snapshot: BucketSnapshot) -> BucketSnapshot:
+        """Ждет, пока префикс перестанет меняться в течение периода debounce"""
+        for _ in range(MAX_DEBOUNCE_ROUNDS):
+            await asyncio.sleep(self.create_snapshot_with_debounce)
+            newer = await self._create_snapshot(prefix)
+            if not snapshot - newer:
+                return newer
+            snapshot = newer
+        return snapshot
+
+    async def get_snapshot(self, prefix: str = "") -> BucketSnapshot:
+        return await self._settle(prefix, await self._create_snapshot(prefix))
+
+    async def watch(
+        self,
+        prefix: str = "",
+        since: Optional[BucketSnapshot] = None,
+        min_interval: float = 1.0,
+        max_interval: float = 30.0,
+    ) -> AsyncIterator[BucketSnapshotDiff]:
+        """
+        Следит за изменениями файлов с prefix и выдает их пачками.
+
+        Пока изменений нет, интервал опроса удваивается от min_interval до
+        max_interval, после изменения сбрасывается. Найденные изменения выдаются,
+        когда префикс успокоится (см. create_snapshot_with_debounce). Пока
+        потребитель обрабатывает событие, опрос не идет, а все, что изменилось
+        за это время, придет одним следующим событием. Чтобы продолжить после
+        перезапуска, сохраните diff.snapshot (BucketSnapshot.save) и передайте
+        его в since.
+        """
+        current = since if since is not None else await self._create_snapshot(prefix)
+        interval = min_interval
+        while True:
+            await asyncio.sleep(interval)
+            latest = await self._create_snapshot(prefix)
+            if not current - latest:
+                interval = min(interval * 2, max_interval)
+                continue
+            latest = await self._settle(prefix, latest)
+            diff = current - latest
+            current = latest
+            interval = min_interval
+            if diff:
+                diff.snapshot = latest
+                yield diff
+
     async def list_all_filenames(self) -> List[str]:
-        paginator = self.client.get_paginator("list_objects_v2")
-        page_iterator = paginator.paginate(Bucket=self.bucket_name)
-        filenames = []
-        for page in page_iterator:
-            for obj in page.get("Contents", []):
-                filenames.append(obj["Key"])
-        return filenames
+        if self.index is not None:
+            return [meta.key for meta in await self._indexed_objects()]
+        return [obj["Key"] async for obj in self._iter_objects()]
 
     async def get_all_keys(self) -> List[dict]:
-        paginator = self.client.get_paginator("list_objects_v2")
-        page_iterator = paginator.paginate(Bucket=self.bucket_name)
-        keys = []
-        for page in page_iterator:
-            keys.extend(page.get("Contents", []))
-        return keys
+        if self.index is not None:
+            return [
+                _meta_object(meta, self.bucket_name)
+                for meta in await self._indexed_objects()
+            ]
+        return [obj async for obj in self._iter_objects()]
 
 
 class CephStorageProvider:
-    def __init__(self, client, bucket_name: str):
+    def __init__(self, client, bucket_name: str, index: Optional[MetadataIndex] = None):
         self.client = client
         self.bucket_name = bucket_name
+        self.index = index
 
     def get_storage(self) -> CephStorage:
-        return CephStorage(bucket_name=self.bucket_name, client=self.client)
+        return CephStorage(
+            bucket_name=self.bucket_name, client=self.client, index=self.index
+        )
 
 
 def plugin_init(
@@ -404,6 +1574,7 @@ def plugin_init(
     is_secure: bool = False,
     access_key: Optional[str] = None,
     secret_key: Optional[str] = None,
+    max_pool_connections: int = 32,
 ) -> Any:
     cleaned_url = endpoint_url.strip().rstrip("/")
     try:
@@ -414,7 +1585,11 @@ def plugin_init(
             aws_access_key_id=access_key,
             aws_secret_access_key=secret_key,
             region_name="ru-7",
-            config=Config(s3={"addressing_style": "path"}, retries={"max_attempts": 3}),
+            config=Config(
+                s3={"addressing_style": "path"},
+                retries={"max_attempts": 3},
+                max_pool_connections=max_pool_connections,
+            ),
         )
         yield client
         yield Type[CephAdapterProvider]
@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from attr import attrib, dataclass
+
+from src.plotva.plugins.s3 import CephStorage
+
+__all__ = [
+    "AsyncCephStorage",
+    "create_async_client",
+]
+
+
+def create_async_client(
+    endpoint_url: str,
+    is_secure: bool = False,
+    access_key: Optional[str] = None,
+    secret_key: Optional[str] = None,
+    max_pool_connections: int = 64,
+    connect_timeout: float = 5.0,
+    read_timeout: float = 60.0,
+    keepalive_timeout: float = 30.0,
+) -> Any:
+    """
+    Асинхронный S3 клиент на aiobotocore. Возвращает асинхронный контекстный
+    менеджер: соединения пула живут, пока открыт контекст.
+    """
+    cleaned_url = endpoint_url.strip().rstrip("/")
+    return get_session().create_client(
+        "s3",
+        endpoint_url=cleaned_url,
+        verify=False,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        region_name="ru-7",
+        config=AioConfig(
+            s3={"addressing_style": "path"},
+            retries={"max_attempts": 3},
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            connector_args={"keepalive_timeout": keepalive_timeout},
+        ),
+    )
+
+
+@dataclass(slots=True)
+class AsyncCephStorage(CephStorage):
+    """
+    CephStorage поверх aiobotocore: запросы выполняются прямо в event loop без
+    потоков, одновременно не больше max_concurrency запросов. Бакет создается
+    не в конструкторе, а вызовом ensure_bucket.
+    """
+
+    _semaphore: Optional[asyncio.Semaphore] = attrib(init=False, default=None)
+
+    def __attrs_post_init__(self) -> None:
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def _call(self, method: str, **kwargs: Any) -> Any:
+        async with self._semaphore:
+            return await getattr(self.client, method)(**kwargs)
+
+    async def _read_body(self, response: dict) -> bytes:
+        async with self._semaphore:
+            async with response["Body"] as stream:
+                return await stream.read()
+
+    async def _iter_body(self, response: dict, chunk_size: int) -> AsyncIterator[bytes]:
+        # Семафор не держим: потребитель может читать поток сколько угодно долго
+        async with response["Body"] as stream:
+            while chunk := await stream.read(chunk_size):
+                yield chunk
+
+    async def _presign(
+        self, method: str, params: Dict[str, Any], expires_in: int
+    ) -> str:
+        return await self.client.generate_presigned_url(
+            method, Params=params, ExpiresIn=expires_in
+        )
+
+    async def close(self) -> None:
+        pass
@@ -1,6 +1,13 @@
 from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
+
+
+def _check_photo_url(value: Optional[str]) -> Optional[str]:
+    # Ключи хранилища выставляют только загрузки фото, клиент передает data URI
+    if value is not None and not value.startswith("data:image"):
+        raise ValueError("photo_url must be a data:image URI")
+    return value
 
 
 class CreateUserDTO(BaseModel):
@@ -11,6 +18,11 @@ class CreateUserDTO(BaseModel):
     email: str
     hashed_password_base64: str
 
+    @field_validator("photo_url")
+    @classmethod
+    def check_photo_url(cls, value: Optional[str]) -> Optional[str]:
+        return _check_photo_url(value)
+
 
 class UpdateUserDTO(BaseModel):
     name: Optional[str] = None
@@ -18,3 +30,8 @@ class UpdateUserDTO(BaseModel):
     photo_url: Optional[str] = None
     phone_number: Optional[str] = None
     email: Optional[str] = None
+
+    @field_validator("photo_url")
+    @classmethod
+    def check_photo_url(cls, value: Optional[str]) -> Optional[str]:
+        return _check_photo_url(value)
@@ -0,0 +1,225 @@
+import asyncio
+import base64
+import io
+from concurrent.futures import Executor
+from typing import AsyncIterable, AsyncIterator, Dict, Tuple
+from uuid import UUID
+
+from attr import dataclass
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from src.plotva.plugins.s3 import CephIOFileNotFoundException, CephStorage
+
+
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+MAX_PHOTO_BYTES = 15 * 1024 * 1024
+MAX_PHOTO_PIXELS = 40_000_000
+
+# Защита от "декомпрессионных бомб": выше MAX_IMAGE_PIXELS Pillow только
+# предупреждает и бросает DecompressionBombError лишь с вдвое большего размера,
+# поэтому размер проверяется явно в process_photo до декодирования
+Image.MAX_IMAGE_PIXELS = MAX_PHOTO_PIXELS
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+class PhotoTooLargeError(InvalidImageError):
+    pass
+
+
+class PhotoUploadError(RuntimeError):
+    pass
+
+
+@dataclass(slots=True, frozen=True)
+class PhotoVariant:
+    name: str
+    max_size: int
+    format: str
+    quality: int
+
+
+# Первый вариант - основной, его ключ сохраняется в photo_url
+PHOTO_VARIANTS: Tuple[PhotoVariant, ...] = (
+    PhotoVariant(name="photo.jpg", max_size=1024, format="JPEG", quality=85),
+    PhotoVariant(name="photo_512.webp", max_size=512, format="WEBP", quality=80),
+    PhotoVariant(name="photo_128.webp", max_size=128, format="WEBP", quality=75),
+)
+# Исходный файл при потоковой загрузке сохраняется как есть
+PHOTO_ORIGINAL = "photo_original"
+
+# Сигнатуры ALLOWED_FORMATS: мусор отбрасывается до загрузки в хранилище
+_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
+_SIGNATURE_SIZE = 12
+
+
+def parse_base64_image(data_uri: str) -> bytes:
+    if not data_uri.startswith("data:image"):
+        raise ValueError("Неверный формат изображения")
+
+    try:
+        header, encoded = data_uri.split(",", 1)
+        return base64.b64decode(encoded)
+    except Exception as e:
+        raise ValueError(f"Ошибка парсинга base64: {e}")
+
+
+def _is_image_header(header: bytes) -> bool:
+    if header.startswith(_SIGNATURES):
+        return True
+    return header[:4] == b"RIFF" and header[8:12] == b"WEBP"
+
+
+async def _capped(
+    chunks: AsyncIterable[bytes], limit: int, sink: bytearray
+) -> AsyncIterator[bytes]:
+    """
+    Пропускает поток дальше, копируя его в sink. Бросает InvalidImageError, если
+    поток не начинается с сигнатуры изображения, и PhotoTooLargeError после limit байт.
+    """
+    checked = False
+    async for chunk in chunks:
+        if len(sink) + len(chunk) > limit:
+            raise PhotoTooLargeError("Изображение слишком большое")
+        sink += chunk
+        if checked:
+            yield chunk
+        elif len(sink) >= _SIGNATURE_SIZE:
+            if not _is_image_header(bytes(sink[:_SIGNATURE_SIZE])):
+                raise InvalidImageError("Неверный формат изображения")
+            checked = True
+            # Начало потока накапливалось до проверки сигнатуры
+            yield bytes(sink)
+    if not checked:
+        raise InvalidImageError("Неверный формат изображения")
+
+
+def _encode(image: Image.Image, variant: PhotoVariant) -> bytes:
+    if variant.format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    elif variant.format == "WEBP" and image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in image.mode or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    buffer = io.BytesIO()
+    if variant.format == "JPEG":
+        image.save(
+            buffer, "JPEG", quality=variant.quality, optimize=True, progressive=True
+        )
+    else:
+        image.save(buffer, variant.format, quality=variant.quality, method=4)
+    return buffer.getvalue()
+
+
+def process_photo(
+    data: bytes, variants: Tuple[PhotoVariant, ...] = PHOTO_VARIANTS
+) -> Dict[str, bytes]:
+    """
+    Проверяет изображение и готовит уменьшенные перекодированные варианты.
+    Выполняется в пуле процессов: декодирование и ресайз занимают CPU.
+    """
+    if len(data) > MAX_PHOTO_BYTES:
+        raise InvalidImageError("Изображение слишком большое")
+    largest = max(variant.max_size for variant in variants)
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise InvalidImageError(
+                    f"Неподдерживаемый формат изображения: {image.format}"
+                )
+            if image.width * image.height > MAX_PHOTO_PIXELS:
+                raise PhotoTooLargeError("Слишком большое разрешение изображения")
+            # JPEG декодируется сразу в уменьшенном в 2-8 раз размере
+            image.draft("RGB", (largest, largest))
+            image.load()
+            image = ImageOps.exif_transpose(image)
+    except Image.DecompressionBombError as e:
+        raise PhotoTooLargeError("Слишком большое разрешение изображения") from e
+    except (UnidentifiedImageError, OSError) as e:
+        raise InvalidImageError(f"Не удалось прочитать изображение: {e}") from e
+
+    results = {}
+    # От большего варианта к меньшему: каждый следующий уменьшается из предыдущего
+    for variant in sorted(variants, key=lambda v: v.max_size, reverse=True):
+        image = image.copy()
+        image.thumbnail((variant.max_size, variant.max_size), Image.Resampling.LANCZOS)
+        results[variant.name] = _encode(image, variant)
+    return results
+
+
+def user_photo_prefix(user_id: UUID) -> str:
+    return f"users/{user_id}/"
+
+
+def photo_key(user_id: UUID, variant: PhotoVariant = PHOTO_VARIANTS[0]) -> str:
+    return f"{user_photo_prefix(user_id)}{variant.name}"
+
+
+def original_key(user_id: UUID) -> str:
+    return f"{user_photo_prefix(user_id)}{PHOTO_ORIGINAL}"
+
+
+@dataclass(slots=True)
+class PhotoUploader:
+    """
+    Обрабатывает фото пользователя в пуле процессов и загружает все варианты
+    параллельно. Возвращает ключ основного варианта.
+    """
+
+    storage: CephStorage
+    executor: Executor
+
+    async def __call__(self, user_id: UUID, data_uri: str) -> str:
+        return await self._upload_variants(user_id, parse_base64_image(data_uri))
+
+    async def upload_stream(self, user_id: UUID, chunks: AsyncIterable[bytes]) -> str:
+        """
+        Потоково записывает исходный файл в хранилище (не больше MAX_PHOTO_BYTES),
+        затем готовит и загружает варианты. Тело запроса не декодируется из base64
+        и не копируется в JSON: в памяти остается одна его копия для ресайза.
+        """
+        original = original_key(user_id)
+        data = bytearray()
+        await self.storage.write_stream(
+            original, _capped(chunks, MAX_PHOTO_BYTES, data)
+        )
+        return await self._process(user_id, data)
+
+    async def process_original(self, user_id: UUID) -> str:
+        """
+        Готовит варианты из исходного файла, который клиент загрузил в хранилище
+        сам по подписанной ссылке (см. original_key).
+        """
+        data = bytearray()
+        chunks = self.storage.read_stream(original_key(user_id))
+        try:
+            async for _ in _capped(chunks, MAX_PHOTO_BYTES, data):
+                pass
+        except CephIOFileNotFoundException as e:
+            raise InvalidImageError("Фото не загружено") from e
+        except InvalidImageError:
+            await self.storage.remove_file(original_key(user_id))
+            raise
+        return await self._process(user_id, data)
+
+    async def _process(self, user_id: UUID, data: bytes) -> str:
+        try:
+            return await self._upload_variants(user_id, data)
+        except InvalidImageError:
+            await self.storage.remove_file(original_key(user_id))
+            raise
+
+    async def _upload_variants(self, user_id: UUID, data: bytes) -> str:
+        loop = asyncio.get_running_loop()
+        variants = await loop.run_in_executor(self.executor, process_photo, data)
+        results = await self.storage.put_many(
+            {
+                f"{user_photo_prefix(user_id)}{name}": content
+                for name, content in variants.items()
+            }
+        )
+        failed = [result.key for result in results.values() if not result.ok]
+        if failed:
+            raise PhotoUploadError(f"Не удалось загрузить {', '.join(failed)}")
+        return photo_key(user_id)
@@ -0,0 +1,40 @@
+from typing import AsyncIterable, Optional
+from uuid import UUID
+
+from attr import dataclass
+
+from user_service.domain.base import IUnitOfWork, BaseUseCase
+from user_service.infrastructure.database.models import UserModel
+from user_service.app.services.photos import PhotoUploader
+
+
+@dataclass(slots=True)
+class UpdateUserPhotoUseCase(BaseUseCase):
+    uow: IUnitOfWork
+    photo_uploader: PhotoUploader
+
+    async def __call__(
+        self, user_id: UUID, chunks: Optional[AsyncIterable[bytes]] = None
+    ) -> Optional[UserModel]:
+        """
+        chunks - тело с фото; без него обрабатывается исходный файл, загруженный
+        клиентом напрямую в хранилище по подписанной ссылке
+        """
+        async with self.uow:
+            if not await self.uow.user_repo.get_by_id(user_id):
+                return None
+
+        # Загрузка может быть долгой, транзакцию на это время не держим
+        if chunks is None:
+            photo_url = await self.photo_uploader.process_original(user_id)
+        else:
+            photo_url = await self.photo_uploader.upload_stream(user_id, chunks)
+
+        async with self.uow:
+            user = await self.uow.user_repo.get_by_id(user_id)
+            if not user:
+                return None
+            user.photo_url = photo_url
+            await self.uow.user_repo.update(user)
+            await self.uow.commit()
+            return user
@@ -7,8 +7,7 @@ from attr import dataclass
 from user_service.domain.base import IUnitOfWork, BaseUseCase
 from user_service.infrastructure.database.models import UserModel
 from user_service.app.dtos.user_dtos import UpdateUserDTO
-from src.plotva.plugins.s3 import CephStorage
-from user_service.app.use_cases.user.create_user import parse_base64_image
+from user_service.app.services.photos import InvalidImageError, PhotoUploader
 
 
 logger = logging.getLogger(__name__)
@@ -17,7 +16,7 @@ logger = logging.getLogger(__name__)
 @dataclass(slots=True)
 class UpdateUserUseCase(BaseUseCase):
     uow: IUnitOfWork
-    s3_storage: CephStorage
+    photo_uploader: PhotoUploader
 
     async def __call__(self, user_id: UUID, dto: UpdateUserDTO) -> Optional[UserModel]:
         async with self.uow:
@@ -26,10 +25,10 @@ class UpdateUserUseCase(BaseUseCase):
                 return None
             if dto.photo_url and dto.photo_url.startswith("data:image"):
                 try:
-                    image_data = parse_base64_image(dto.photo_url)
-                    filename = f"users/{user_id}/photo.jpg"
-                    await self.s3_storage.write_file(filename, image_data)
+                    filename = await self.photo_uploader(user_id, dto.photo_url)
                     dto = dto.model_copy(update={"photo_url": filename})
+                except InvalidImageError:
+                    raise
                 except Exception as e:
                     logger.error(f"Ошибка обновления фото: {e}")
                     raise ValueError("Не удалось загрузить новое фото") from e
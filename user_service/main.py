@@ -2,20 +2,30 @@ import os
 import asyncio
 import json
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator
 from uuid import UUID
 
-from aiohttp import web
+from aiohttp import BodyPartReader, web
 from dotenv import load_dotenv
 
 
-from src.plotva.plugins.s3 import plugin_init, CephStorageProvider, CephStorage
+from src.plotva.plugins.s3_async import AsyncCephStorage, create_async_client
 from user_service.app.dtos.user_dtos import UpdateUserDTO, CreateUserDTO
+from user_service.app.services.photos import (
+    MAX_PHOTO_BYTES,
+    PhotoTooLargeError,
+    PhotoUploader,
+    original_key,
+    user_photo_prefix,
+)
 from user_service.app.dtos.cart_dtos import (
     AddProductToCartDTO,
     ClearCartDTO,
     RemoveProductFromCartDTO,
 )
 from user_service.app.use_cases.user.update_user import UpdateUserUseCase
+from user_service.app.use_cases.user.update_photo import UpdateUserPhotoUseCase
 from user_service.app.use_cases.user.create_user import CreateUserUseCase
 from user_service.app.use_cases.user.delete_user_by_id import DeleteUserByIdUseCase
 from user_service.app.use_cases.user.get_all_users import GetAllUsersUseCase
@@ -37,16 +47,40 @@ S3_ENDPOINT = os.getenv("S3_ENDPOINT")
 S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY")
 S3_SECRET_KEY = os.getenv("S3_SECRET_KEY")
 S3_BUCKET = os.getenv("S3_BUCKET")
-
-s3_client = plugin_init(
-    endpoint_url=S3_ENDPOINT, access_key=S3_ACCESS_KEY, secret_key=S3_SECRET_KEY
-).__next__()
-
-s3_storage = CephStorageProvider(s3_client, S3_BUCKET).get_storage()
-
-
-def get_s3_storage() -> CephStorage:
-    return s3_storage
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "64"))
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "32"))
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", "2"))
+PHOTO_CHUNK_SIZE = 256 * 1024
+PHOTO_URL_EXPIRES = int(os.getenv("PHOTO_URL_EXPIRES", "3600"))
+PHOTO_UPLOAD_URL_EXPIRES = int(os.getenv("PHOTO_UPLOAD_URL_EXPIRES", "900"))
+
+
+def get_s3_storage(app: web.Application) -> AsyncCephStorage:
+    return app["s3_storage"]
+
+
+def get_photo_uploader(app: web.Application) -> PhotoUploader:
+    return app["photo_uploader"]
+
+
+async def user_to_dict(app: web.Application, user) -> dict:
+    """
+    Вместо ключа фото в хранилище отдает подписанную ссылку на него в Ceph.
+    Подписываются только ключи из каталога пользователя (users/<user_id>/),
+    другие ключи не отдаются, чтобы через photo_url нельзя было прочитать
+    чужой объект бакета.
+    """
+    data = user.to_dict()
+    photo_url = data["photo_url"]
+    if not photo_url or photo_url.startswith(("data:", "http://", "https://")):
+        return data
+    if photo_url.startswith(user_photo_prefix(user.user_id)):
+        data["photo_url"] = await get_s3_storage(app).presigned_url(
+            photo_url, expires_in=PHOTO_URL_EXPIRES
+        )
+    else:
+        data["photo_url"] = None
+    return data
 
 
 class UUIDEncoder(json.JSONEncoder):
@@ -67,31 +101,182 @@ async def update_user_handler(request: web.Request) -> web.Response:
         dto = UpdateUserDTO(**data)
 
         uow = await get_uow(request.app)
-        use_case = UpdateUserUseCase(uow=uow)
+        use_case = UpdateUserUseCase(
+            uow=uow, photo_uploader=get_photo_uploader(request.app)
+        )
 
         updated_user = await use_case(user_id, dto)
 
         if not updated_user:
             return web.json_response({"error": "User not found"}, status=404)
         logger.info(f"User with email: {updated_user.email} updated")
-        return web.json_response(updated_user.to_dict(), status=200)
+        return web.json_response(
+            await user_to_dict(request.app, updated_user), status=200
+        )
+
+    except ValueError as ve:
+        logger.warning(f"Validation error: {ve}")
+        return web.json_response(
+            {"error": "Invalid request data", "details": str(ve)}, status=400
+        )
 
     except Exception as e:
         logger.error(f"Error updating user: {e}", exc_info=True)
         return web.json_response({"error": "Internal server error"}, status=500)
 
 
+async def _iter_body_part(part: BodyPartReader) -> AsyncIterator[bytes]:
+    while chunk := await part.read_chunk(PHOTO_CHUNK_SIZE):
+        yield chunk
+
+
+async def _photo_chunks(request: web.Request) -> AsyncIterator[bytes]:
+    """
+    Тело запроса с фото: поле photo из multipart/form-data или само тело
+    с Content-Type image/*. Читается потоково, без request.read()/json().
+    """
+    if request.content_type.startswith("multipart/"):
+        reader = await request.multipart()
+        while (part := await reader.next()) is not None:
+            if isinstance(part, BodyPartReader) and part.name == "photo":
+                return _iter_body_part(part)
+        raise ValueError("Photo field is required")
+    if not request.content_type.startswith("image/"):
+        raise ValueError("Unsupported content type")
+    if request.content_length is not None and request.content_length > MAX_PHOTO_BYTES:
+        raise PhotoTooLargeError("Photo is too large")
+    return request.content.iter_chunked(PHOTO_CHUNK_SIZE)
+
+
+async def upload_user_photo_handler(request: web.Request) -> web.Response:
+    try:
+        user_id = UUID(request.match_info["user_id"])
+        chunks = await _photo_chunks(request)
+
+        uow = await get_uow(request.app)
+        use_case = UpdateUserPhotoUseCase(
+            uow=uow, photo_uploader=get_photo_uploader(request.app)
+        )
+
+        updated_user = await use_case(user_id, chunks)
+
+        if not updated_user:
+            return web.json_response({"error": "User not found"}, status=404)
+        logger.info(f"User with email: {updated_user.email} photo updated")
+        return web.json_response(
+            await user_to_dict(request.app, updated_user), status=200
+        )
+
+    except PhotoTooLargeError as e:
+        logger.warning(f"Validation error: {e}")
+        return web.json_response(
+            {"error": "Photo is too large", "max_bytes": MAX_PHOTO_BYTES}, status=413
+        )
+
+    except ValueError as ve:
+        logger.warning(f"Validation error: {ve}")
+        return web.json_response(
+            {"error": "Invalid request data", "details": str(ve)}, status=400
+        )
+
+    except Exception as e:
+        logger.error(f"Error uploading user photo: {e}", exc_info=True)
+        return web.json_response({"error": "Internal server error"}, status=500)
+
+
+async def photo_upload_url_handler(request: web.Request) -> web.Response:
+    """Ссылка для загрузки фото клиентом напрямую в Ceph, минуя сервис"""
+    try:
+        user_id = UUID(request.match_info["user_id"])
+
+        uow = await get_uow(request.app)
+        use_case = GetUserByIdUseCase(uow=uow)
+
+        user = await use_case(user_id)
+
+        if not user:
+            return web.json_response({"error": "User not found"}, status=404)
+        url = await get_s3_storage(request.app).presigned_url(
+            original_key(user_id), method="PUT", expires_in=PHOTO_UPLOAD_URL_EXPIRES
+        )
+        return web.json_response(
+            {
+                "url": url,
+                "method": "PUT",
+                "expires_in": PHOTO_UPLOAD_URL_EXPIRES,
+                "max_bytes": MAX_PHOTO_BYTES,
+            },
+            status=200,
+        )
+
+    except ValueError as ve:
+        logger.warning(f"Validation error: {ve}")
+        return web.json_response(
+            {"error": "Invalid request data", "details": str(ve)}, status=400
+        )
+
+    except Exception as e:
+        logger.error(f"Error issuing photo upload url: {e}", exc_info=True)
+        return web.json_response({"error": "Internal server error"}, status=500)
+
+
+async def photo_uploaded_handler(request: web.Request) -> web.Response:
+    """Клиент загрузил фото по ссылке из photo_upload_url_handler"""
+    try:
+        user_id = UUID(request.match_info["user_id"])
+
+        uow = await get_uow(request.app)
+        use_case = UpdateUserPhotoUseCase(
+            uow=uow, photo_uploader=get_photo_uploader(request.app)
+        )
+
+        updated_user = await use_case(user_id)
+
+        if not updated_user:
+            return web.json_response({"error": "User not found"}, status=404)
+        logger.info(f"User with email: {updated_user.email} photo updated")
+        return web.json_response(
+            await user_to_dict(request.app, updated_user), status=200
+        )
+
+    except PhotoTooLargeError as e:
+        logger.warning(f"Validation error: {e}")
+        return web.json_response(
+            {"error": "Photo is too large", "max_bytes": MAX_PHOTO_BYTES}, status=413
+        )
+
+    except ValueError as ve:
+        logger.warning(f"Validation error: {ve}")
+        return web.json_response(
+            {"error": "Invalid request data", "details": str(ve)}, status=400
+        )
+
+    except Exception as e:
+        logger.error(f"Error processing uploaded photo: {e}", exc_info=True)
+        return web.json_response({"error": "Internal server error"}, status=500)
+
+
 async def create_user_handler(request: web.Request) -> web.Response:
     try:
         data = await request.json()
         dto = CreateUserDTO(**data)
 
         uow = await get_uow(request.app)
-        use_case = CreateUserUseCase(uow=uow, s3_storage=app["s3_storage"])
+        use_case = CreateUserUseCase(
+            uow=uow, photo_uploader=get_photo_uploader(request.app)
+        )
 
         created_user = await use_case(dto)
         logger.info(f"User with email: {dto.email} created")
-        return web.json_response(created_user.to_dict(), status=201)
+        return web.json_response(
+            await user_to_dict(request.app, created_user), status=201
+        )
+
+    except ValueError as ve:
+        logger.warning(f"Validation error: {ve}")
+        return web.json_response(
+            {"error": "Invalid request data", "details": str(ve)}, status=400
+        )
 
     except Exception as e:
         logger.error(f"Error creating user: {e}")
@@ -127,7 +312,9 @@ async def get_all_users_handler(request: web.Request) -> web.Response:
             return web.json_response({"message": "No users found"}, status=200)
 
         logger.info("Cписок пользователей получен")
-        return web.json_response([user.to_dict() for user in users], status=200)
+        return web.json_response(
+            [await user_to_dict(request.app, user) for user in users], status=200
+        )
 
     except Exception as e:
         logger.error(f"Error fetching users: {e}")
@@ -148,7 +335,7 @@ async def get_user_by_email_handler(request: web.Request) -> web.Response:
         if not user:
             return web.json_response({"error": "User not found"}, status=404)
         logger.info(f"Запрошен пользователь {user_email}")
-        return web.json_response(user.to_dict(), status=200)
+        return web.json_response(await user_to_dict(request.app, user), status=200)
 
     except Exception as e:
         logger.error(f"Error fetching user by email: {e}")
@@ -169,7 +356,7 @@ async def get_user_by_id_handler(request: web.Request) -> web.Response:
         if not user:
             return web.json_response({"error": "User not found"}, status=404)
         logger.info(f"Запрошен пользователь {user_id}")
-        return web.json_response(user.to_dict(), status=200)
+        return web.json_response(await user_to_dict(request.app, user), status=200)
 
     except Exception as e:
         logger.error(f"Error fetching user by email: {e}")
@@ -291,11 +478,33 @@ async def on_startup(app):
         raise
 
 
+async def s3_storage_ctx(app):
+    async with create_async_client(
+        endpoint_url=S3_ENDPOINT,
+        access_key=S3_ACCESS_KEY,
+        secret_key=S3_SECRET_KEY,
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+    ) as client:
+        storage = AsyncCephStorage(
+            bucket_name=S3_BUCKET, client=client, max_concurrency=S3_MAX_CONCURRENCY
+        )
+        await storage.ensure_bucket()
+        app["s3_storage"] = storage
+        logger.info("Хранилище S3 инициализировано")
+        # Декодирование и ресайз фото нагружают CPU и не должны блокировать event loop
+        with ProcessPoolExecutor(max_workers=PHOTO_WORKERS) as executor:
+            app["photo_uploader"] = PhotoUploader(storage=storage, executor=executor)
+            yield
+        await storage.close()
+
+
 app = web.Application()
 app["engine"] = engine
-app["s3_storage"] = s3_storage
 
 app.router.add_put("/users/{user_id}", update_user_handler)
+app.router.add_put("/users/{user_id}/photo", upload_user_photo_handler)
+app.router.add_post("/users/{user_id}/photo/upload-url", photo_upload_url_handler)
+app.router.add_post("/users/{user_id}/photo/uploaded", photo_uploaded_handler)
 app.router.add_post("/users", create_user_handler)
 app.router.add_delete("/users/{user_id}", delete_user_handler)
 app.router.add_get("/users/list", get_all_users_handler)
@@ -309,6 +518,7 @@ app.router.add_delete("/cart/remove", delete_from_cart_by_id_handler)
 
 
 app.on_startup.append(on_startup)
+app.cleanup_ctx.append(s3_storage_ctx)
 
 if __name__ == "__main__":
     loop = asyncio.SelectorEventLoop()